@@ -22,6 +22,13 @@ with open(filepath.joinpath("model_config.toml"), mode="rb") as fp:
 
 config = Config(MODEL_CONFIG)
 
+
+def get_model_options(section: str, model: str) -> dict:
+    """Options of a config section, overridden by its per-model table `[<section>.models."<model>"]`"""
+    options = {key: value for key, value in MODEL_CONFIG[section].items() if not isinstance(value, dict)}
+    options.update(MODEL_CONFIG[section].get("models", {}).get(model, {}))
+    return options
+
 # print(f"Model Config: \n{json.dumps(MODEL_CONFIG, indent=4)}")
 
 if config.network.proxy.enable:
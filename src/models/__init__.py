@@ -1 +1,5 @@
-from .embedding import EmbeddingModel
\ No newline at end of file
+from .embedding import EmbeddingModel
+from .onnx_embedding import ORTEmbeddingModel
+from .replicas import ReplicatedModel
+from .reranker import RerankerModel
+from .utils import cast_embeddings, count_tokens, plan_batches
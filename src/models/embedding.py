@@ -5,8 +5,10 @@
 @LastEditTime: 2024-01-19 12:10:58
 @LastEditors: shenlei
 '''
+import contextlib
 import logging
-from typing import Dict, List, Tuple, Type, Union
+import time
+from typing import Dict, List, Optional, Tuple, Type, Union
 
 import torch
 from numpy import ndarray
@@ -14,17 +16,26 @@ from tqdm import tqdm
 from transformers import AutoModel, AutoTokenizer
 
 from src.utils import logger
+from src.utils.metrics import BATCH_SIZE, FORWARD_TIME, PADDING_RATIO, TOKENIZE_TIME, timed
+
+from .utils import OUTPUT_DTYPES, plan_batches, prefetch, quantize_dynamic
 
 
 class EmbeddingModel:
+    # the length-sorted path tokenizes and sorts this many batches' worth of inputs at a time, so the
+    # first batch starts early and, with `pipeline`, the next window is tokenized while this one runs
+    SORT_WINDOW_BATCHES = 8
+
     def __init__(
             self,
             model_name_or_path: str='maidalun1020/bce-embedding-base_v1',
             pooler: str='cls',
             use_fp16: bool=False,
             device: str=None,
+            quantize: str=None,
             **kwargs
         ):
+        self.model_name = model_name_or_path
         self.tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
         self.model = AutoModel.from_pretrained(model_name_or_path, **kwargs)
         logger.info(f"Loading from `{model_name_or_path}`.")
@@ -51,63 +62,218 @@ class EmbeddingModel:
             self.model.half()
 
         self.model.eval()
+        if quantize is not None:
+            self.model = quantize_dynamic(self.model, quantize, self.device)
         self.model = self.model.to(self.device)
 
         if self.num_gpus > 1:
             self.model = torch.nn.DataParallel(self.model)
         
-        logger.info(f"Execute device: {self.device};\t gpu num: {self.num_gpus};\t use fp16: {use_fp16};\t embedding pooling type: {self.pooler};\t trust remote code: {kwargs.get('trust_remote_code', False)}")
+        logger.info(f"Execute device: {self.device};\t gpu num: {self.num_gpus};\t use fp16: {use_fp16};\t quantize: {quantize};\t embedding pooling type: {self.pooler};\t trust remote code: {kwargs.get('trust_remote_code', False)}")
+
+    def _iter_batches(
+            self,
+            sentences: List[str],
+            batch_size: int,
+            max_length: int,
+            sort_by_length: bool,
+            max_tokens_per_batch: int
+        ):
+        """Yield `(sentence ids, tokenized inputs)` per batch."""
+        token_id_input = len(sentences) > 0 and not isinstance(sentences[0], str)
+        if not sort_by_length and max_tokens_per_batch is None and not token_id_input:
+            for sentence_id in range(0, len(sentences), batch_size):
+                with timed(TOKENIZE_TIME, model=self.model_name):
+                    inputs = self.tokenizer(
+                            sentences[sentence_id:sentence_id+batch_size],
+                            padding=True,
+                            truncation=True,
+                            max_length=max_length,
+                            return_tensors="pt"
+                        )
+                yield list(range(sentence_id, min(sentence_id+batch_size, len(sentences)))), inputs
+            return
+
+        # tokenize a window without padding, then pad every batch only to its own longest member
+        window = batch_size * self.SORT_WINDOW_BATCHES
+        for start in range(0, len(sentences), window):
+            with timed(TOKENIZE_TIME, model=self.model_name):
+                if token_id_input:
+                    encodings = self._wrap_token_ids(sentences[start:start+window], max_length)
+                else:
+                    encodings = self.tokenizer(sentences[start:start+window], truncation=True, max_length=max_length)
+            lengths = [len(ids) for ids in encodings["input_ids"]]
+            batches = plan_batches(
+                lengths,
+                batch_size=batch_size if max_tokens_per_batch is None else None,
+                max_tokens_per_batch=max_tokens_per_batch,
+                sort_by_length=sort_by_length
+            )
+            for batch_ids in batches:
+                features = {k: [v[i] for i in batch_ids] for k, v in encodings.items()}
+                with timed(TOKENIZE_TIME, model=self.model_name):
+                    inputs = self.tokenizer.pad(features, padding=True, return_tensors="pt")
+                yield [start + i for i in batch_ids], inputs
+
+    def _wrap_token_ids(self, token_ids: List[List[int]], max_length: int) -> Dict[str, List[List[int]]]:
+        """Encodings of pre-tokenized inputs (ids of this tokenizer, without special tokens), truncated like text."""
+        room = max_length - self.tokenizer.num_special_tokens_to_add(pair=False)
+        input_ids = [self.tokenizer.build_inputs_with_special_tokens(list(ids[:room])) for ids in token_ids]
+        return {'input_ids': input_ids, 'attention_mask': [[1] * len(ids) for ids in input_ids]}
+
+    def _last_hidden_state(self, inputs_on_device: Dict[str, torch.Tensor]) -> torch.Tensor:
+        return self.model(**inputs_on_device, return_dict=True).last_hidden_state
 
     def encode(
             self,
-            sentences: Union[str, List[str]],
+            sentences: Union[str, List[str], List[List[int]]],
             batch_size: int=256,
             max_length: int=512,
             normalize_to_unit: bool=True,
             return_numpy: bool=True,
             enable_tqdm: bool=True,
             query_instruction: str="",
+            sort_by_length: bool=False,
+            max_tokens_per_batch: int=None,
+            return_token_nums: bool=False,
+            pipeline: bool=False,
+            dimensions: int=None,
+            output_dtype: str="float32",
             **kwargs
         ):
+        """
+        sentences: texts, or lists of token ids of this model's tokenizer without special tokens, which skip tokenization.
+        sort_by_length: batch inputs of similar token length together to reduce padding, sorting within windows of
+            `SORT_WINDOW_BATCHES * batch_size` inputs. Outputs keep the input order.
+        max_tokens_per_batch: limit every batch to `rows * longest sequence <= max_tokens_per_batch` instead of `batch_size` rows.
+        return_token_nums: also return the number of tokens the model consumed per sentence, read from the attention masks.
+        pipeline: tokenize on a background thread up to a window ahead of the model; on CUDA also copy through pinned host memory
+            without blocking, so the host only waits for the device once, after the last batch.
+        dimensions: keep the first `dimensions` components (Matryoshka truncation), re-normalized when `normalize_to_unit`.
+        output_dtype: "float32", "float16" or "int8" (symmetric, one float32 scale per row: vector ~= int8 * scale).
+            Truncation and the cast happen on the device, before the copy to host memory.
+        Returns the embeddings, followed by the int8 scales when `output_dtype` is "int8" and by the token
+        numbers when `return_token_nums`.
+        """
+        if output_dtype not in OUTPUT_DTYPES:
+            raise ValueError(f"`output_dtype` should be in {list(OUTPUT_DTYPES)}, got '{output_dtype}'")
         if self.num_gpus > 1:
             batch_size = batch_size * self.num_gpus
+            if max_tokens_per_batch is not None:
+                max_tokens_per_batch = max_tokens_per_batch * self.num_gpus
         
         if isinstance(sentences, str):
             sentences = [sentences]
+        if isinstance(query_instruction, str) and len(query_instruction) > 0:
+            if len(sentences) > 0 and not isinstance(sentences[0], str):
+                instruction_ids = self.tokenizer(query_instruction, add_special_tokens=False)['input_ids']
+                sentences = [instruction_ids+list(ids) for ids in sentences]
+            else:
+                sentences = [query_instruction+sent for sent in sentences]
         
-        with torch.no_grad():
+        async_copy = pipeline and self.device.startswith('cuda')
+        # events and copies below go to the current stream of the model's device
+        device_scope = torch.cuda.device(self.device) if async_copy else contextlib.nullcontext()
+        with torch.no_grad(), device_scope:
             embeddings_collection = []
-            for sentence_id in tqdm(range(0, len(sentences), batch_size), desc='Extract embeddings', disable=not enable_tqdm):
-                if isinstance(query_instruction, str) and len(query_instruction) > 0:
-                    sentence_batch = [query_instruction+sent for sent in sentences[sentence_id:sentence_id+batch_size]] 
-                else:
-                    sentence_batch = sentences[sentence_id:sentence_id+batch_size]
-                inputs = self.tokenizer(
-                        sentence_batch, 
-                        padding=True,
-                        truncation=True,
-                        max_length=max_length,
-                        return_tensors="pt"
-                    )
-                inputs_on_device = {k: v.to(self.device) for k, v in inputs.items()}
-                outputs = self.model(**inputs_on_device, return_dict=True)
+            scales_collection = []
+            token_nums_collection = []
+            order = []
+            # (start, end) CUDA events of batches whose results are still being copied back
+            in_flight = []
+            batches = self._iter_batches(sentences, batch_size, max_length, sort_by_length, max_tokens_per_batch)
+            if pipeline:
+                batches = prefetch(
+                    batches,
+                    depth=self.SORT_WINDOW_BATCHES,
+                    transform=lambda batch: (batch[0], {k: v.pin_memory() for k, v in batch[1].items()}) if async_copy else batch
+                )
+            for batch_ids, inputs in tqdm(batches, desc='Extract embeddings', disable=not enable_tqdm):
+                BATCH_SIZE.labels(model=self.model_name).observe(len(batch_ids))
+                PADDING_RATIO.labels(model=self.model_name).observe(1 - inputs['attention_mask'].float().mean().item())
+                forward_start = time.perf_counter()
+                if async_copy:
+                    start_event = torch.cuda.Event(enable_timing=True)
+                    start_event.record()
+                inputs_on_device = {k: v.to(self.device, non_blocking=async_copy) for k, v in inputs.items()}
+                last_hidden = self._last_hidden_state(inputs_on_device)
 
                 if self.pooler == "cls":
-                    embeddings = outputs.last_hidden_state[:, 0]
+                    embeddings = last_hidden[:, 0]
                 elif self.pooler == "mean":
                     attention_mask = inputs_on_device['attention_mask']
-                    last_hidden = outputs.last_hidden_state
                     embeddings = (last_hidden * attention_mask.unsqueeze(-1).float()).sum(1) / attention_mask.sum(-1).unsqueeze(-1)
                 else:
                     raise NotImplementedError
                 
+                if dimensions is not None:
+                    embeddings = embeddings[:, :dimensions]
                 if normalize_to_unit:
                     embeddings = embeddings / embeddings.norm(dim=1, keepdim=True)
-                embeddings_collection.append(embeddings.cpu())
+                embeddings, scales = self._cast_output(embeddings, output_dtype)
+                if async_copy:
+                    embeddings_collection.append(self._copy_to_pinned(embeddings))
+                    if scales is not None:
+                        scales_collection.append(self._copy_to_pinned(scales))
+                    end_event = torch.cuda.Event(enable_timing=True)
+                    end_event.record()
+                    in_flight.append((start_event, end_event))
+                else:
+                    embeddings_collection.append(embeddings.cpu())
+                    if scales is not None:
+                        scales_collection.append(scales.cpu())
+                    # `.cpu()` waits for the device, so this covers the whole forward pass
+                    FORWARD_TIME.labels(model=self.model_name).observe(time.perf_counter() - forward_start)
+                token_nums_collection.append(inputs['attention_mask'].sum(-1))
+                order.extend(batch_ids)
+
+            for start_event, end_event in in_flight:
+                end_event.synchronize()
+                FORWARD_TIME.labels(model=self.model_name).observe(start_event.elapsed_time(end_event) / 1000)
             
             embeddings = torch.cat(embeddings_collection, dim=0)
+            scales = torch.cat(scales_collection, dim=0) if scales_collection else None
+            token_nums = torch.cat(token_nums_collection, dim=0)
+            if order != list(range(len(order))):
+                # restore the caller's order
+                restore = torch.argsort(torch.tensor(order))
+                embeddings = embeddings[restore]
+                scales = scales[restore] if scales is not None else None
+                token_nums = token_nums[restore]
         
         if return_numpy and not isinstance(embeddings, ndarray):
             embeddings = embeddings.numpy()
+            scales = scales.numpy() if scales is not None else None
         
-        return embeddings
+        outputs = (embeddings,)
+        if output_dtype == "int8":
+            outputs += (scales,)
+        if return_token_nums:
+            outputs += (token_nums.tolist(),)
+        return outputs if len(outputs) > 1 else embeddings
+
+    @staticmethod
+    def _cast_output(embeddings: torch.Tensor, output_dtype: str) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """Cast pooled vectors to `output_dtype` on their device; int8 also returns the per-row scales."""
+        embeddings = embeddings.float()
+        if output_dtype == "float16":
+            return embeddings.half(), None
+        if output_dtype == "int8":
+            scales = embeddings.abs().amax(dim=1).clamp(min=1e-12) / 127
+            return torch.round(embeddings / scales.unsqueeze(1)).to(torch.int8), scales
+        return embeddings, None
+
+    @staticmethod
+    def _copy_to_pinned(tensor: torch.Tensor) -> torch.Tensor:
+        """Start a non-blocking device to host copy; the result is valid once the stream passes this point."""
+        host = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+        host.copy_(tensor, non_blocking=True)
+        return host
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """langchain `Embeddings` compatible entry"""
+        return self.encode(texts, enable_tqdm=False).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """langchain `Embeddings` compatible entry"""
+        return self.encode(text, enable_tqdm=False)[0].tolist()
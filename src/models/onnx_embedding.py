@@ -0,0 +1,93 @@
+import os
+from pathlib import Path
+from typing import Dict
+
+import torch
+from transformers import AutoModel, AutoTokenizer
+
+from src.utils import logger
+
+from .embedding import EmbeddingModel
+
+
+class _LastHiddenState(torch.nn.Module):
+    """Export wrapper returning a plain tensor instead of a ModelOutput."""
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, return_dict=True).last_hidden_state
+
+
+class ORTEmbeddingModel(EmbeddingModel):
+    """`EmbeddingModel` whose encoder runs through ONNX Runtime on CPU.
+
+    The encoder is exported once to `<cache_dir>/<model>/model.onnx` and loaded with all graph
+    optimizations enabled; tokenization, batching and pooling are shared with `EmbeddingModel`. The PyTorch
+    weights are only loaded to export, a cached export starts from the tokenizer alone.
+    """
+
+    def __init__(
+            self,
+            model_name_or_path: str='maidalun1020/bce-embedding-base_v1',
+            pooler: str='cls',
+            num_threads: int=0,
+            cache_dir: str=None,
+            **kwargs
+        ):
+        import onnxruntime as ort
+
+        assert pooler in ['cls', 'mean'], f"`pooler` should be in ['cls', 'mean']. 'cls' is recommended!"
+        self.model_name = model_name_or_path
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+        self.pooler = pooler
+        self.device = "cpu"
+        self.num_gpus = 0
+
+        cache_dir = Path(cache_dir or Path.home() / ".cache" / "kengine" / "onnx")
+        onnx_path = cache_dir / model_name_or_path.strip("/").replace("/", "--") / "model.onnx"
+        if not onnx_path.exists():
+            logger.info(f"Loading from `{model_name_or_path}` to export it.")
+            self._export(AutoModel.from_pretrained(model_name_or_path, **kwargs).eval(), onnx_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path.as_posix(), options, providers=["CPUExecutionProvider"])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+        self.weights_nbytes = os.path.getsize(onnx_path)
+        # the session holds the weights
+        self.model = None
+        logger.info(f"ONNX Runtime session from `{onnx_path}`;\t intra op threads: {num_threads or 'auto'}")
+
+    def _export(self, model: torch.nn.Module, onnx_path: Path):
+        """Export next to `onnx_path` and move it in place, so an interrupted export or concurrent exports
+        from several worker processes never leave a partial `model.onnx` behind."""
+        onnx_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = onnx_path.with_name(f"{onnx_path.stem}.{os.getpid()}.tmp")
+        try:
+            dummy = self.tokenizer(["onnx export"], return_tensors="pt")
+            torch.onnx.export(
+                _LastHiddenState(model),
+                (dummy["input_ids"], dummy["attention_mask"]),
+                tmp_path.as_posix(),
+                input_names=["input_ids", "attention_mask"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "last_hidden_state": {0: "batch", 1: "sequence"},
+                },
+                opset_version=14,
+            )
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        os.replace(tmp_path, onnx_path)
+        logger.info(f"Exported encoder to `{onnx_path}`.")
+
+    def _last_hidden_state(self, inputs_on_device: Dict[str, torch.Tensor]) -> torch.Tensor:
+        feeds = {name: inputs_on_device[name].numpy() for name in self.input_names}
+        return torch.from_numpy(self.session.run(["last_hidden_state"], feeds)[0])
@@ -0,0 +1,96 @@
+"""Measure how far INT8 dynamic quantization moves a model's outputs from full precision.
+
+Usage:
+python -m src.models.quantization --model maidalun1020/bce-embedding-base_v1 --corpus corpus.txt
+python -m src.models.quantization --model maidalun1020/bce-reranker-base_v1 --kind reranker
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.append(Path(__file__).parents[2].as_posix())
+from src.models.embedding import EmbeddingModel
+from src.models.reranker import RerankerModel
+
+SAMPLE_CORPUS = [
+    "What is Llama 2?",
+    "Llama 2 is a collection of pretrained and fine-tuned large language models ranging from 7 billion to 70 billion parameters.",
+    "The quick brown fox jumps over the lazy dog.",
+    "Retrieval augmented generation combines a retriever with a generator to ground answers in documents.",
+    "向量检索通过计算查询与文档向量之间的相似度来召回相关内容。",
+    "为这个句子生成表示以用于检索相关文章：如何降低推理延迟？",
+    "重排序模型对召回的候选文档进行精排，提高最终结果的相关性。",
+    "INT8 dynamic quantization stores Linear weights as 8-bit integers and quantizes activations on the fly.",
+]
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def evaluate_embedding(model_name: str, corpus: List[str], batch_size: int = 32, max_length: int = 512) -> Dict[str, float]:
+    """Cosine similarity between full-precision and INT8 vectors of every text in `corpus`"""
+    encode_kwargs = dict(batch_size=batch_size, max_length=max_length, enable_tqdm=False, sort_by_length=True)
+    reference, reference_seconds = _timed(EmbeddingModel(model_name, device="cpu").encode, corpus, **encode_kwargs)
+    quantized, quantized_seconds = _timed(
+        EmbeddingModel(model_name, device="cpu", quantize="int8").encode, corpus, **encode_kwargs
+    )
+    cosine = (reference * quantized).sum(axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(quantized, axis=1)
+    )
+    return {
+        "texts": len(corpus),
+        "cosine_mean": float(cosine.mean()),
+        "cosine_min": float(cosine.min()),
+        "cosine_p5": float(np.percentile(cosine, 5)),
+        "reference_seconds": reference_seconds,
+        "quantized_seconds": quantized_seconds,
+        "speedup": reference_seconds / quantized_seconds,
+    }
+
+
+def evaluate_reranker(model_name: str, corpus: List[str], batch_size: int = 32, max_length: int = 512) -> Dict[str, float]:
+    """Score drift of INT8 against full precision over all (query, passage) pairs of `corpus`"""
+    pairs = [(query, passage) for query in corpus for passage in corpus if query != passage]
+    score_kwargs = dict(batch_size=batch_size, max_length=max_length, enable_tqdm=False)
+    reference, reference_seconds = _timed(RerankerModel(model_name, device="cpu").compute_score, pairs, **score_kwargs)
+    quantized, quantized_seconds = _timed(
+        RerankerModel(model_name, device="cpu", quantize="int8").compute_score, pairs, **score_kwargs
+    )
+    drift = np.abs(np.asarray(reference) - np.asarray(quantized))
+    return {
+        "pairs": len(pairs),
+        "score_drift_mean": float(drift.mean()),
+        "score_drift_max": float(drift.max()),
+        "rank_correlation": float(np.corrcoef(np.argsort(np.argsort(reference)), np.argsort(np.argsort(quantized)))[0, 1]),
+        "reference_seconds": reference_seconds,
+        "quantized_seconds": quantized_seconds,
+        "speedup": reference_seconds / quantized_seconds,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="INT8 dynamic quantization drift report")
+    parser.add_argument("--model", required=True, type=str, help="model name or path")
+    parser.add_argument("--kind", default="embedding", choices=["embedding", "reranker"])
+    parser.add_argument("--corpus", type=str, default=None, help="text file with one sample per line")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-length", type=int, default=512)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    corpus = SAMPLE_CORPUS
+    if args.corpus:
+        corpus = [line.strip() for line in open(args.corpus, encoding="utf-8") if line.strip()]
+    evaluate = evaluate_embedding if args.kind == "embedding" else evaluate_reranker
+    report = evaluate(args.model, corpus, batch_size=args.batch_size, max_length=args.max_length)
+    print(json.dumps({"model": args.model, "kind": args.kind, **report}, indent=4))
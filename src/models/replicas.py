@@ -0,0 +1,136 @@
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+import numpy as np
+
+from src.utils import logger
+
+
+class ReplicatedModel:
+    """One model copy per device, each with its own queue and worker thread.
+
+    Calls are routed to the replica with the fewest inputs outstanding, so a slow device receives less
+    work instead of holding up the others. `encode` splits large inputs into `batch_size` chunks spread
+    over the replicas and reassembles the results in order; other calls run on a single replica.
+    `close` stops the worker threads, which otherwise keep every replica alive.
+    """
+
+    def __init__(self, factory: Callable[[str], Any], devices: List[str]):
+        self.devices = devices
+        self.replicas = [factory(device) for device in devices]
+        self._queues = [queue.Queue() for _ in devices]
+        self._outstanding = [0] * len(devices)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._serve, args=(index,), name=f"replica-{device}", daemon=True)
+            for index, device in enumerate(devices)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Replicated model over devices: {devices}")
+
+    @property
+    def num_replicas(self) -> int:
+        return len(self.replicas)
+
+    @property
+    def device(self) -> str:
+        return "replicas:" + ",".join(self.devices)
+
+    @property
+    def tokenizer(self):
+        return self.replicas[0].tokenizer
+
+    def outstanding(self) -> List[int]:
+        with self._lock:
+            return list(self._outstanding)
+
+    def _serve(self, index: int):
+        replica = self.replicas[index]
+        while True:
+            job = self._queues[index].get()
+            if job is None:
+                return
+            method, args, kwargs, size, future = job
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(getattr(replica, method)(*args, **kwargs))
+                except Exception as e:
+                    future.set_exception(e)
+            with self._lock:
+                self._outstanding[index] -= size
+
+    def submit(self, method: str, size: int, *args, **kwargs) -> Future:
+        """Queue `replica.<method>(*args, **kwargs)` on the least loaded replica; `size` is its share of load."""
+        with self._lock:
+            index = min(range(len(self._queues)), key=lambda i: self._outstanding[i])
+        return self._submit_to(index, method, size, *args, **kwargs)
+
+    def _submit_to(self, index: int, method: str, size: int, *args, **kwargs) -> Future:
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"Replicated model over {self.devices} is closed")
+            self._outstanding[index] += size
+            # under the lock, so no call is queued behind the stop sentinel of `close`
+            self._queues[index].put((method, args, kwargs, size, future))
+        return future
+
+    def broadcast(self, method: str, *args, **kwargs) -> List[Any]:
+        """Run `replica.<method>(*args, **kwargs)` on every replica, e.g. to warm all devices up."""
+        futures = [self._submit_to(index, method, 0, *args, **kwargs) for index in range(len(self._queues))]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """Let the replicas finish the queued calls, stop their threads and drop the model copies."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for replica_queue in self._queues:
+            replica_queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self.replicas = []
+
+    def encode(self, sentences, batch_size: int=256, return_token_nums: bool=False, **kwargs):
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        if len(sentences) == 0:
+            return self.replicas[0].encode(sentences, batch_size=batch_size, return_token_nums=return_token_nums, **kwargs)
+        futures = [
+            self.submit(
+                "encode",
+                len(chunk),
+                chunk,
+                batch_size=batch_size,
+                return_token_nums=return_token_nums,
+                **kwargs
+            )
+            for chunk in (sentences[i:i+batch_size] for i in range(0, len(sentences), batch_size))
+        ]
+        results = [future.result() for future in futures]
+        if not isinstance(results[0], tuple):
+            return np.concatenate(results)
+        # (embeddings, [scales], [token_nums]): arrays are concatenated, lists chained
+        return tuple(
+            np.concatenate(parts) if isinstance(parts[0], np.ndarray) else [value for part in parts for value in part]
+            for parts in zip(*results)
+        )
+
+    def rerank(self, query: str, passages: List[str], **kwargs):
+        return self.submit("rerank", len(passages), query, passages, **kwargs).result()
+
+    def compute_score(self, sentence_pairs, **kwargs):
+        return self.submit("compute_score", len(sentence_pairs), sentence_pairs, **kwargs).result()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """langchain `Embeddings` compatible entry"""
+        return self.encode(texts, enable_tqdm=False).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """langchain `Embeddings` compatible entry"""
+        return self.encode(text, enable_tqdm=False)[0].tolist()
@@ -0,0 +1,173 @@
+import time
+from typing import Dict, List, Tuple, Union
+
+import torch
+from tqdm import tqdm
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from src.utils import logger
+from src.utils.metrics import BATCH_SIZE, FORWARD_TIME, PADDING_RATIO, TOKENIZE_TIME, timed
+
+from .utils import plan_batches, quantize_dynamic
+
+
+class RerankerModel:
+    def __init__(
+            self,
+            model_name_or_path: str='maidalun1020/bce-reranker-base_v1',
+            use_fp16: bool=False,
+            device: str=None,
+            quantize: str=None,
+            **kwargs
+        ):
+        self.model_name = model_name_or_path
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_name_or_path, **kwargs)
+        logger.info(f"Loading from `{model_name_or_path}`.")
+
+        num_gpus = torch.cuda.device_count()
+        if device is None:
+            self.device = "cuda" if num_gpus > 0 else "cpu"
+        else:
+            self.device = 'cuda:{}'.format(int(device)) if device.isdigit() else device
+
+        if self.device == "cpu":
+            self.num_gpus = 0
+        elif self.device.startswith('cuda:') and num_gpus > 0:
+            self.num_gpus = 1
+        elif self.device == "cuda":
+            self.num_gpus = num_gpus
+        else:
+            raise ValueError("Please input valid device: 'cpu', 'cuda', 'cuda:0', '0' !")
+
+        if use_fp16:
+            self.model.half()
+
+        self.model.eval()
+        if quantize is not None:
+            self.model = quantize_dynamic(self.model, quantize, self.device)
+        self.model = self.model.to(self.device)
+
+        if self.num_gpus > 1:
+            self.model = torch.nn.DataParallel(self.model)
+
+        logger.info(f"Execute device: {self.device};\t gpu num: {self.num_gpus};\t use fp16: {use_fp16};\t quantize: {quantize}")
+
+    def _score_features(
+            self,
+            features: List[Dict[str, List[int]]],
+            batch_size: int,
+            max_tokens_per_batch: int,
+            enable_tqdm: bool
+        ) -> List[float]:
+        """Score tokenized pairs in length-sorted batches; scores keep the order of `features`."""
+        if self.num_gpus > 1:
+            batch_size = batch_size * self.num_gpus
+            if max_tokens_per_batch is not None:
+                max_tokens_per_batch = max_tokens_per_batch * self.num_gpus
+
+        batches = plan_batches(
+            [len(feature['input_ids']) for feature in features],
+            batch_size=batch_size if max_tokens_per_batch is None else None,
+            max_tokens_per_batch=max_tokens_per_batch
+        )
+        scores = [0.0] * len(features)
+        with torch.no_grad():
+            for batch_ids in tqdm(batches, desc='Calculate scores', disable=not enable_tqdm):
+                with timed(TOKENIZE_TIME, model=self.model_name):
+                    inputs = self.tokenizer.pad([features[i] for i in batch_ids], padding=True, return_tensors="pt")
+                BATCH_SIZE.labels(model=self.model_name).observe(len(batch_ids))
+                PADDING_RATIO.labels(model=self.model_name).observe(1 - inputs['attention_mask'].float().mean().item())
+                forward_start = time.perf_counter()
+                inputs_on_device = {k: v.to(self.device) for k, v in inputs.items()}
+                logits = self.model(**inputs_on_device, return_dict=True).logits.view(-1).float()
+                batch_scores = torch.sigmoid(logits).cpu().tolist()
+                FORWARD_TIME.labels(model=self.model_name).observe(time.perf_counter() - forward_start)
+                for i, score in zip(batch_ids, batch_scores):
+                    scores[i] = score
+        return scores
+
+    def _pair_features(self, query_ids: List[int], passage_ids: List[int]) -> Dict[str, List[int]]:
+        input_ids = self.tokenizer.build_inputs_with_special_tokens(query_ids, passage_ids)
+        feature = {'input_ids': input_ids, 'attention_mask': [1] * len(input_ids)}
+        if 'token_type_ids' in self.tokenizer.model_input_names:
+            feature['token_type_ids'] = self.tokenizer.create_token_type_ids_from_sequences(query_ids, passage_ids)
+        return feature
+
+    def compute_score(
+            self,
+            sentence_pairs: Union[List[Tuple[str, str]], Tuple[str, str]],
+            batch_size: int=256,
+            max_length: int=512,
+            max_tokens_per_batch: int=None,
+            enable_tqdm: bool=True,
+            **kwargs
+        ) -> List[float]:
+        """Score query-passage pairs, passages are truncated to `max_length`."""
+        if isinstance(sentence_pairs[0], str):
+            sentence_pairs = [sentence_pairs]
+
+        with timed(TOKENIZE_TIME, model=self.model_name):
+            encodings = self.tokenizer(
+                    [pair[0] for pair in sentence_pairs],
+                    [pair[1] for pair in sentence_pairs],
+                    truncation='only_second',
+                    max_length=max_length
+                )
+        features = [{k: v[i] for k, v in encodings.items()} for i in range(len(sentence_pairs))]
+        return self._score_features(features, batch_size, max_tokens_per_batch, enable_tqdm)
+
+    def rerank(
+            self,
+            query: str,
+            passages: List[str],
+            batch_size: int=256,
+            max_length: int=512,
+            overlap_tokens: int=80,
+            max_tokens_per_batch: int=None,
+            top_n: int=None,
+            enable_tqdm: bool=False,
+            **kwargs
+        ) -> Dict[str, list]:
+        """Rank `passages` by relevance to `query`.
+
+        Passages longer than the room left next to the query are split into windows overlapping by
+        `overlap_tokens`; a passage scores as its best window. Returns the passages, scores and their
+        original ids sorted by score, truncated to `top_n`, plus the number of tokens scored.
+        """
+        if len(passages) == 0:
+            return {'rerank_passages': [], 'rerank_scores': [], 'rerank_ids': [], 'token_num': 0}
+
+        with timed(TOKENIZE_TIME, model=self.model_name):
+            query_ids = self.tokenizer(query, add_special_tokens=False)['input_ids'][:max_length // 2]
+            passages_ids = self.tokenizer(passages, add_special_tokens=False)['input_ids']
+        passage_room = max_length - len(query_ids) - self.tokenizer.num_special_tokens_to_add(pair=True)
+        overlap_tokens = min(overlap_tokens, passage_room // 2)
+
+        features, owners = [], []
+        for passage_id, passage_ids in enumerate(passages_ids):
+            start = 0
+            while True:
+                features.append(self._pair_features(query_ids, passage_ids[start:start+passage_room]))
+                owners.append(passage_id)
+                if start + passage_room >= len(passage_ids):
+                    break
+                start += passage_room - overlap_tokens
+
+        window_scores = self._score_features(features, batch_size, max_tokens_per_batch, enable_tqdm)
+        scores = [0.0] * len(passages)
+        for passage_id, score in zip(owners, window_scores):
+            scores[passage_id] = max(scores[passage_id], score)
+
+        rerank_ids = sorted(range(len(passages)), key=lambda i: scores[i], reverse=True)
+        if top_n is not None:
+            if top_n < 1:
+                # a negative slice would silently drop results from the end
+                raise ValueError(f"`top_n` should be a positive integer, got {top_n}")
+            rerank_ids = rerank_ids[:top_n]
+        return {
+            'rerank_passages': [passages[i] for i in rerank_ids],
+            'rerank_scores': [scores[i] for i in rerank_ids],
+            'rerank_ids': rerank_ids,
+            'token_num': sum(len(feature['input_ids']) for feature in features),
+        }
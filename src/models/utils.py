@@ -0,0 +1,119 @@
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+OUTPUT_DTYPES = ("float32", "float16", "int8")
+
+
+def plan_batches(
+        lengths: Sequence[int],
+        batch_size: Optional[int]=None,
+        max_tokens_per_batch: Optional[int]=None,
+        sort_by_length: bool=True,
+    ) -> List[List[int]]:
+    """Group sample indices into batches.
+
+    With `sort_by_length` the samples are visited from longest to shortest, so that every batch holds
+    sequences of similar length and pads little. A batch is closed when it reaches `batch_size` rows or
+    when its padded size (`rows * longest sequence`) would exceed `max_tokens_per_batch`.
+    """
+    order = range(len(lengths))
+    if sort_by_length:
+        order = sorted(order, key=lambda i: lengths[i], reverse=True)
+
+    batches, batch, batch_max_len = [], [], 0
+    for idx in order:
+        new_max_len = max(batch_max_len, lengths[idx])
+        full_by_rows = batch_size is not None and len(batch) >= batch_size
+        full_by_tokens = max_tokens_per_batch is not None and new_max_len * (len(batch) + 1) > max_tokens_per_batch
+        if batch and (full_by_rows or full_by_tokens):
+            batches.append(batch)
+            batch, new_max_len = [], lengths[idx]
+        batch.append(idx)
+        batch_max_len = new_max_len
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def prefetch(items: Iterable[Any], depth: int=2, transform: Optional[Callable[[Any], Any]]=None) -> Iterator[Any]:
+    """Produce `items` (optionally through `transform`) on a background thread, up to `depth` ahead of the consumer.
+
+    Exceptions raised while producing are re-raised to the consumer; the producer stops when the consumer does.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    end = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(transform(item) if transform is not None else item):
+                    return
+        except Exception as e:
+            put(e)
+        put(end)
+
+    threading.Thread(target=produce, name="prefetch", daemon=True).start()
+    try:
+        while (item := buffer.get()) is not end:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def count_tokens(tokenizer, texts: List[str], max_length: Optional[int]=None) -> List[int]:
+    """Count the tokens (special tokens included) of each text in one batched tokenizer call."""
+    encodings = tokenizer(
+            texts,
+            truncation=max_length is not None,
+            max_length=max_length,
+            return_attention_mask=False,
+            return_token_type_ids=False
+        )
+    return [len(ids) for ids in encodings["input_ids"]]
+
+
+def quantize_dynamic(model, quantize: str, device: str):
+    """Dynamically quantize the Linear layers of `model`, weights to INT8 and activations at runtime."""
+    import torch
+
+    if quantize != "int8":
+        raise ValueError(f"`quantize` should be in ['int8'], got '{quantize}'")
+    if device != "cpu":
+        raise ValueError(f"Dynamic INT8 quantization runs on CPU only, got device '{device}'")
+    return torch.quantization.quantize_dynamic(model.float(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def cast_embeddings(embeddings, output_dtype: str="float32", dimensions: Optional[int]=None, normalize: bool=False) -> Tuple[Any, Any]:
+    """NumPy counterpart of the on-device output handling of `EmbeddingModel.encode`, for vectors already on
+    the host: truncate to `dimensions` (re-normalizing when `normalize`) and cast to `output_dtype`.
+
+    Returns the vectors and, for int8, the per-row float32 scales (None otherwise).
+    """
+    import numpy as np
+
+    if output_dtype not in OUTPUT_DTYPES:
+        raise ValueError(f"`output_dtype` should be in {list(OUTPUT_DTYPES)}, got '{output_dtype}'")
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dimensions is not None and dimensions < embeddings.shape[-1]:
+        embeddings = embeddings[:, :dimensions]
+        if normalize:
+            embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    if output_dtype == "float16":
+        return embeddings.astype(np.float16), None
+    if output_dtype == "int8":
+        scales = np.maximum(np.abs(embeddings).max(axis=1), 1e-12) / 127
+        return np.round(embeddings / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return embeddings, None
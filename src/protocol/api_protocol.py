@@ -124,6 +124,47 @@ class APITokenCheckResponse(BaseModel):
     prompts: List[APITokenCheckResponseItem]
 
 
+class TokenCountRequest(BaseModel):
+    model: Optional[str] = None
+    input: Union[str, List[Any]]
+
+
+class TokenCountItem(BaseModel):
+    index: int
+    tokens: int
+    truncated: bool
+
+
+class TokenCountResponse(BaseModel):
+    object: str = "list"
+    model: str
+    data: List[TokenCountItem]
+    total_tokens: int
+    max_length: int
+
+
+class RerankRequest(BaseModel):
+    model: Optional[str] = None
+    query: str
+    documents: List[str]
+    top_n: Optional[int] = None
+    return_documents: bool = True
+
+
+class RerankResult(BaseModel):
+    index: int
+    relevance_score: float
+    document: Optional[str] = None
+
+
+class RerankResponse(BaseModel):
+    id: str = Field(default_factory=lambda: f"rerank-{shortuuid.random()}")
+    object: str = "list"
+    model: str
+    results: List[RerankResult]
+    usage: UsageInfo
+
+
 class CompletionRequest(BaseModel):
     model: str
     prompt: Union[str, List[Any]]
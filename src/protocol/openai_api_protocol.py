@@ -139,6 +139,13 @@ class EmbeddingsRequest(BaseModel):
     input: Union[str, List[Any]]
     user: Optional[str] = None
     encoding_format: Optional[str] = None
+    # keep the first `dimensions` components, re-normalized
+    dimensions: Optional[int] = None
+    # "float32" | "float16" | "int8" (each int8 item carries a `scale`)
+    embedding_dtype: Optional[str] = None
+    # "query": latency-sensitive retrieval queries, prefixed with the model's query instruction and
+    # scheduled ahead of "passage" (the default) document batches
+    input_type: Optional[str] = None
 
 
 class EmbeddingsResponse(BaseModel):
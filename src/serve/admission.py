@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from configs import MODEL_CONFIG
+
+# tenant of requests without an API key (no `api_keys` configured)
+ANONYMOUS = "anonymous"
+
+
+class RequestTooLargeError(ValueError):
+    """The request exceeds a per-request limit and would never be admitted."""
+
+
+class RateLimitedError(RuntimeError):
+    """The tenant is over its rate; `retry_after` seconds until the request would fit."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Holds up to `burst` units, refilled at `rate` units per second."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.level = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.burst, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available, 0 when they are now. An amount above `burst` only
+        waits for a full bucket and leaves it in debt."""
+        self._refill()
+        missing = min(amount, self.burst) - self.level
+        return max(missing, 0) / self.rate
+
+    def take(self, amount: float):
+        self.level -= amount
+
+    def give_back(self, amount: float):
+        self.level = min(self.burst, self.level + amount)
+
+
+def estimate_tokens(inputs: Sequence[Union[str, List[int]]], max_length: int) -> int:
+    """Upper estimate of the tokens of `inputs` before tokenizing: a text has at most about one token per
+    character, plus special tokens. Settled against the real count once the request is done."""
+    return sum(min(len(item) + 2, max_length) for item in inputs)
+
+
+class AdmissionController:
+    """Per-tenant (API key) token buckets for requests and tokens, plus per-request size limits.
+
+    Options come from `[admission]`, overridden per key by `[admission.keys."<key>"]`. Tokens are reserved
+    with an estimate at admission and settled with the real count afterwards.
+    """
+
+    def __init__(self):
+        self._buckets: Dict[str, Dict[str, Optional[TokenBucket]]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return MODEL_CONFIG.get("admission", {}).get("enable", False)
+
+    @staticmethod
+    def options(tenant: str) -> Dict[str, Any]:
+        section = MODEL_CONFIG.get("admission", {})
+        options = {key: value for key, value in section.items() if not isinstance(value, dict)}
+        options.update(section.get("keys", {}).get(tenant, {}))
+        return options
+
+    def _tenant_buckets(self, tenant: str) -> Dict[str, Optional[TokenBucket]]:
+        if tenant not in self._buckets:
+            options = self.options(tenant)
+            self._buckets[tenant] = {
+                "requests": TokenBucket(options["requests_per_second"], options["request_burst"])
+                if options["requests_per_second"] > 0
+                else None,
+                "tokens": TokenBucket(options["tokens_per_second"], options["token_burst"])
+                if options["tokens_per_second"] > 0
+                else None,
+            }
+        return self._buckets[tenant]
+
+    def check_size(self, tenant: str, items: int, tokens: int):
+        options = self.options(tenant)
+        if options["max_input_items"] > 0 and items > options["max_input_items"]:
+            raise RequestTooLargeError(f"{items} inputs exceed the limit of {options['max_input_items']} per request")
+        if options["max_request_tokens"] > 0 and tokens > options["max_request_tokens"]:
+            raise RequestTooLargeError(
+                f"about {tokens} tokens exceed the limit of {options['max_request_tokens']} per request"
+            )
+
+    def admit(self, tenant: str, items: int, tokens: int, requests: int = 1, check_size: bool = True):
+        """Take `requests` and `tokens` from the tenant's buckets, or raise without taking anything."""
+        if not self.enabled:
+            return
+        if check_size:
+            self.check_size(tenant, items, tokens)
+        with self._lock:
+            buckets = self._tenant_buckets(tenant)
+            wanted = [(buckets["requests"], requests), (buckets["tokens"], tokens)]
+            wanted = [(bucket, amount) for bucket, amount in wanted if bucket is not None and amount > 0]
+            retry_after = max((bucket.wait_time(amount) for bucket, amount in wanted), default=0)
+            if retry_after > 0:
+                raise RateLimitedError("rate limit of this API key exceeded", retry_after=retry_after)
+            for bucket, amount in wanted:
+                bucket.take(amount)
+
+    async def wait_tokens(self, tenant: str, tokens: int):
+        """Take `tokens` from the tenant's bucket, waiting for them instead of raising; throttles bulk streams."""
+        while True:
+            try:
+                return self.admit(tenant, 0, tokens, requests=0, check_size=False)
+            except RateLimitedError as e:
+                await asyncio.sleep(e.retry_after)
+
+    def settle(self, tenant: str, reserved: int, used: int):
+        """Return the part of a token reservation the request did not use."""
+        if not self.enabled or reserved <= used:
+            return
+        with self._lock:
+            bucket = self._tenant_buckets(tenant)["tokens"]
+            if bucket is not None:
+                bucket.give_back(reserved - used)
+
+
+admission = AdmissionController()
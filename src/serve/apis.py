@@ -9,12 +9,29 @@ from starlette.responses import HTMLResponse
 
 from src.protocol.api_protocol import BaseResponse
 from src.serve.openai_api_server import check_api_key
-from src.serve.utils import create_embeddings, document
+from src.serve.utils import (
+    count_input_tokens,
+    create_embeddings,
+    create_rerank,
+    document,
+    get_cache_stats,
+    get_metrics,
+    get_pool_stats,
+    health_live,
+    health_ready,
+    stream_embeddings,
+)
 
 
 def mount_app_routes(app: FastAPI):
     app.get("/", include_in_schema=False, response_model=BaseResponse, summary="swagger 文档")(document)
 
+    app.get("/health/live", tags=["health"], summary="存活检查")(health_live)
+
+    app.get("/health/ready", tags=["health"], summary="就绪检查：预加载模型全部预热完成后返回 200")(health_ready)
+
+    app.get("/metrics", tags=["health"], summary="Prometheus 监控指标")(get_metrics)
+
     app.post(
         "/v1/embeddings",
         tags=["embedding"],
@@ -29,6 +46,41 @@ def mount_app_routes(app: FastAPI):
         summary="文本向量化",
     )(create_embeddings)
 
+    app.post(
+        "/v1/embeddings/stream",
+        tags=["embedding"],
+        dependencies=[Depends(check_api_key)],
+        summary="批量文本向量化：NDJSON / JSON 数组输入，按批流式返回 NDJSON",
+    )(stream_embeddings)
+
+    app.get(
+        "/v1/embeddings/cache",
+        tags=["embedding"],
+        dependencies=[Depends(check_api_key)],
+        summary="向量缓存命中统计",
+    )(get_cache_stats)
+
+    app.post(
+        "/v1/token_count",
+        tags=["embedding"],
+        dependencies=[Depends(check_api_key)],
+        summary="统计文本 token 数（不执行推理）",
+    )(count_input_tokens)
+
+    app.post(
+        "/v1/rerank",
+        tags=["rerank"],
+        dependencies=[Depends(check_api_key)],
+        summary="文本重排序",
+    )(create_rerank)
+
+    app.get(
+        "/v1/pool",
+        tags=["model"],
+        dependencies=[Depends(check_api_key)],
+        summary="常驻模型与淘汰统计",
+    )(get_pool_stats)
+
 
 def MakeFastAPIOffline(
     app: FastAPI,
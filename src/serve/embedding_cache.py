@@ -0,0 +1,285 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from ..utils.Logger import logger
+
+
+def text_digest(text: Union[str, Sequence[int]]) -> bytes:
+    if not isinstance(text, str):
+        # token ids of the serving model, kept apart from any text by the 0xff prefix (never valid utf-8)
+        return hashlib.blake2b(b"\xff" + np.asarray(text, dtype="<i4").tobytes(), digest_size=16).digest()
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class DiskEmbeddingStore:
+    """Append-only float32 vector file, memory-mapped, plus a digest index that survives restarts.
+
+    ``vectors.f32`` holds row ``i`` for the ``i``-th 16 byte digest in ``index.bin``, and ``tokens.i32``
+    its token count. Rows are flushed before their digest is appended, so the index never references a
+    row that was not written. Processes sharing a directory (forked workers, instances behind the router)
+    append under an exclusive ``flock`` on ``lock`` and first pick up the rows the others appended.
+    """
+
+    DIGEST_SIZE = 16
+
+    def __init__(self, directory: str, dim: int, initial_rows: int = 1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self._vector_path = self.directory / "vectors.f32"
+        self._index_path = self.directory / "index.bin"
+        self._tokens_path = self.directory / "tokens.i32"
+        self._lock_fp = open(self.directory / "lock", "ab")
+        try:
+            self._load(initial_rows)
+        except BaseException:
+            self._lock_fp.close()
+            raise
+
+    def _load(self, initial_rows: int):
+        """Index the stored rows and open the files, dropping a tail a crashed writer left unindexed."""
+        dim = self.dim
+        with self._locked(fcntl.LOCK_EX):
+            self._check_meta()
+            self._rows: Dict[bytes, int] = {}
+            self._count = 0
+            if self._index_path.exists():
+                raw = self._index_path.read_bytes()
+                stored_rows = os.path.getsize(self._vector_path) // (4 * dim) if self._vector_path.exists() else 0
+                stored_tokens = os.path.getsize(self._tokens_path) // 4 if self._tokens_path.exists() else 0
+                usable = min(len(raw) // self.DIGEST_SIZE, stored_rows, stored_tokens)
+                for row in range(usable):
+                    self._rows[raw[row * self.DIGEST_SIZE : (row + 1) * self.DIGEST_SIZE]] = row
+                self._count = usable
+            self._token_nums = (
+                np.fromfile(self._tokens_path, dtype=np.int32, count=self._count).tolist() if self._count else []
+            )
+
+            capacity = max(initial_rows, self._count)
+            if not self._vector_path.exists() or os.path.getsize(self._vector_path) < capacity * 4 * dim:
+                with open(self._vector_path, "ab") as fp:
+                    fp.truncate(capacity * 4 * dim)
+            self._open()
+            self._index_fp = open(self._index_path, "ab")
+            self._index_fp.truncate(self._count * self.DIGEST_SIZE)
+            self._tokens_fp = open(self._tokens_path, "ab")
+            self._tokens_fp.truncate(self._count * 4)
+
+    @contextmanager
+    def _locked(self, operation: int):
+        fcntl.flock(self._lock_fp, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fp, fcntl.LOCK_UN)
+
+    def _check_meta(self):
+        meta_path = self.directory / "meta.json"
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            if meta.get("dim") != self.dim:
+                raise ValueError(f"Embedding cache at {self.directory} stores dim={meta.get('dim')}, got dim={self.dim}")
+        else:
+            meta_path.write_text(json.dumps({"dim": self.dim, "dtype": "float32"}))
+
+    def _open(self):
+        rows = os.path.getsize(self._vector_path) // (4 * self.dim)
+        self._vectors = np.memmap(self._vector_path, dtype=np.float32, mode="r+", shape=(rows, self.dim))
+
+    def _grow(self, min_rows: int):
+        rows = self._vectors.shape[0]
+        while rows < min_rows:
+            rows *= 2
+        self._vectors.flush()
+        del self._vectors
+        with open(self._vector_path, "ab") as fp:
+            fp.truncate(rows * 4 * self.dim)
+        self._open()
+
+    def _sync(self):
+        """Index the rows other processes appended since this store last looked; the caller holds the lock."""
+        rows = min(os.path.getsize(self._index_path) // self.DIGEST_SIZE, os.path.getsize(self._tokens_path) // 4)
+        if rows <= self._count:
+            return
+        with open(self._index_path, "rb") as fp:
+            fp.seek(self._count * self.DIGEST_SIZE)
+            raw = fp.read((rows - self._count) * self.DIGEST_SIZE)
+        token_nums = np.fromfile(self._tokens_path, dtype=np.int32, count=rows - self._count, offset=self._count * 4)
+        for i in range(rows - self._count):
+            self._rows[raw[i * self.DIGEST_SIZE : (i + 1) * self.DIGEST_SIZE]] = self._count + i
+        self._token_nums.extend(token_nums.tolist())
+        self._count = rows
+        if rows > self._vectors.shape[0]:
+            # the vector file was grown by another process
+            self._vectors.flush()
+            del self._vectors
+            self._open()
+
+    def refresh(self):
+        """Pick up rows appended by other processes, a stat when there are none."""
+        if os.path.getsize(self._index_path) != self._count * self.DIGEST_SIZE:
+            with self._locked(fcntl.LOCK_SH):
+                self._sync()
+
+    def __len__(self):
+        return self._count
+
+    def get(self, digest: bytes) -> Optional[Tuple[np.ndarray, int]]:
+        row = self._rows.get(digest)
+        if row is None:
+            return None
+        return np.array(self._vectors[row]), self._token_nums[row]
+
+    def put_many(self, digests: Sequence[bytes], vectors: np.ndarray, token_nums: Sequence[int]):
+        with self._locked(fcntl.LOCK_EX):
+            self._sync()
+            new = {}
+            for digest, vector, token_num in zip(digests, vectors, token_nums):
+                if digest not in self._rows:
+                    new[digest] = (vector, token_num)
+            if not new:
+                return
+            if self._count + len(new) > self._vectors.shape[0]:
+                self._grow(self._count + len(new))
+            start = self._count
+            self._vectors[start : start + len(new)] = np.stack([vector for vector, _ in new.values()])
+            self._vectors.flush()
+            self._tokens_fp.write(np.asarray([token_num for _, token_num in new.values()], dtype=np.int32).tobytes())
+            self._tokens_fp.flush()
+            self._index_fp.write(b"".join(new))
+            self._index_fp.flush()
+            for row, (digest, (_, token_num)) in enumerate(new.items(), start):
+                self._rows[digest] = row
+                self._token_nums.append(token_num)
+            self._count += len(new)
+
+    def close(self):
+        self._vectors.flush()
+        del self._vectors
+        self._index_fp.close()
+        self._tokens_fp.close()
+        self._lock_fp.close()
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache with an in-memory LRU tier and an optional on-disk tier.
+
+    Entries are grouped by namespace, which identifies everything besides the text that determines a
+    vector (model and the options it is served with, query instruction, output dimensions and dtype).
+    Vectors are stored as float32, holding the values of the output dtype (int8 rows dequantized). Each
+    entry keeps the vector and the number of tokens the model consumed for it, so cache hits can still be
+    reported in usage.
+    """
+
+    # disk stores kept open at once, least recently used are closed beyond that (each holds a memmap and two files)
+    MAX_OPEN_STORES = 16
+
+    def __init__(self, max_items: int = 100000, disk_dir: Optional[str] = None):
+        self.max_items = max_items
+        self.disk_dir = disk_dir
+        self._memory: "OrderedDict[tuple, Tuple[np.ndarray, int]]" = OrderedDict()
+        self._disk: "OrderedDict[str, DiskEmbeddingStore]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def namespace(
+        model: str,
+        pooler: str,
+        normalize: bool,
+        query_instruction: str = "",
+        dimensions: Optional[int] = None,
+        dtype: str = "float32",
+        backend: str = "native",
+        max_length: Optional[int] = None,
+        use_fp16: bool = False,
+        quantize: str = "",
+    ) -> str:
+        # every serving option that changes the vectors or token counts, so switching one (e.g. to
+        # `quantize = "int8"`) starts a new namespace instead of mixing both variants in one index
+        spec = [model, pooler, bool(normalize), query_instruction or ""]
+        spec += [backend, max_length, bool(use_fp16), quantize or ""]
+        if dimensions is not None or dtype != "float32":
+            spec += [dimensions, dtype]
+        spec = json.dumps(spec, ensure_ascii=False)
+        return hashlib.sha1(spec.encode("utf-8")).hexdigest()
+
+    def _disk_store(self, namespace: str, dim: int = None) -> Optional[DiskEmbeddingStore]:
+        if not self.disk_dir:
+            return None
+        if namespace not in self._disk:
+            directory = Path(self.disk_dir) / namespace
+            if dim is None:
+                meta_path = directory / "meta.json"
+                if not meta_path.exists():
+                    return None
+                dim = json.loads(meta_path.read_text())["dim"]
+            self._disk[namespace] = DiskEmbeddingStore(directory, dim)
+            logger.info(f"Opened embedding disk cache {directory} with {len(self._disk[namespace])} vectors")
+            while len(self._disk) > self.MAX_OPEN_STORES:
+                self._disk.popitem(last=False)[1].close()
+        self._disk.move_to_end(namespace)
+        return self._disk[namespace]
+
+    def get_many(self, namespace: str, texts: Sequence[str]) -> List[Optional[Tuple[np.ndarray, int]]]:
+        """Look up `(vector, token_num)` for every text, `None` on a miss."""
+        results = []
+        with self._lock:
+            store = self._disk_store(namespace)
+            if store is not None:
+                store.refresh()
+            for text in texts:
+                key = (namespace, text_digest(text))
+                entry = self._memory.get(key)
+                if entry is not None:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                elif store is not None and (entry := store.get(key[1])) is not None:
+                    self._remember(key, entry)
+                    self.hits += 1
+                    self.disk_hits += 1
+                else:
+                    self.misses += 1
+                results.append(entry)
+        return results
+
+    def put_many(self, namespace: str, texts: Sequence[str], vectors: np.ndarray, token_nums: Sequence[int]):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(texts) == 0:
+            return
+        digests = [text_digest(text) for text in texts]
+        with self._lock:
+            for digest, vector, token_num in zip(digests, vectors, token_nums):
+                # a copy, a row view would keep the whole batch matrix alive past `max_items`
+                self._remember((namespace, digest), (vector.copy(), int(token_num)))
+            store = self._disk_store(namespace, dim=vectors.shape[1])
+            if store is not None:
+                store.put_many(digests, vectors, token_nums)
+
+    def _remember(self, key: tuple, entry: Tuple[np.ndarray, int]):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_items": len(self._memory),
+            "disk_items": sum(len(store) for store in self._disk.values()),
+        }
@@ -0,0 +1,110 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+from ..utils.metrics import QUEUE_WAIT
+
+
+class EngineOverloadedError(RuntimeError):
+    """Raised instead of queueing more work than the engine is configured to hold."""
+
+
+class _PriorityGate:
+    """Lets at most `slots` jobs into a lane; when one finishes, the waiting job with the lowest
+    `priority` (then the earliest) goes next. Lives on the event loop, no locking."""
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.running = 0
+        self._waiting: List[Tuple[int, int, asyncio.Future]] = []
+        self._arrival = itertools.count()
+
+    async def acquire(self, priority: int):
+        if self.running < self.slots and not self._waiting:
+            self.running += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._arrival), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                # cancelled right after the slot was handed over
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                # hand the slot over, `running` stays the same
+                future.set_result(None)
+                return
+        self.running -= 1
+
+
+class InferenceExecutor:
+    """Run blocking forward passes off the event loop.
+
+    Every device gets its own lane: a thread pool of `workers_per_device` threads (1 serializes forward
+    passes on the device) and at most `max_queue` jobs waiting in front of it. Jobs beyond that are
+    rejected with `EngineOverloadedError` rather than held in memory. A lane fronting several devices,
+    such as a `ReplicatedModel`, is opened with a matching `concurrency`. Waiting jobs enter the thread
+    pool by `priority` (lower first), so a query batch overtakes queued document batches and only waits
+    for the forward passes already running.
+    """
+
+    def __init__(self, max_queue: int = 32, workers_per_device: int = 1):
+        self.max_queue = max_queue
+        self.workers_per_device = workers_per_device
+        self._lanes: Dict[str, ThreadPoolExecutor] = {}
+        self._gates: Dict[str, _PriorityGate] = {}
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _lane(self, device: str, concurrency: int) -> Tuple[ThreadPoolExecutor, _PriorityGate]:
+        with self._lock:
+            if device not in self._lanes:
+                self._lanes[device] = ThreadPoolExecutor(
+                    max_workers=self.workers_per_device * concurrency, thread_name_prefix=f"inference-{device}"
+                )
+                self._gates[device] = _PriorityGate(self.workers_per_device * concurrency)
+            return self._lanes[device], self._gates[device]
+
+    async def run(
+        self, device: str, fn: Callable[..., Any], *args, concurrency: int = 1, priority: int = 0, **kwargs
+    ) -> Any:
+        lane, gate = self._lane(device, concurrency)
+        with self._lock:
+            if self._pending[device] >= (self.max_queue + self.workers_per_device) * concurrency:
+                raise EngineOverloadedError(f"Inference queue of {device} is full ({self.max_queue} jobs waiting)")
+            self._pending[device] += 1
+        submitted = time.perf_counter()
+
+        def job():
+            QUEUE_WAIT.labels(stage="executor").observe(time.perf_counter() - submitted)
+            return fn(*args, **kwargs)
+
+        try:
+            await gate.acquire(priority)
+            try:
+                return await asyncio.get_running_loop().run_in_executor(lane, job)
+            finally:
+                gate.release()
+        finally:
+            with self._lock:
+                self._pending[device] -= 1
+
+    def stats(self) -> Dict[str, int]:
+        """Jobs running or waiting per device"""
+        with self._lock:
+            return dict(self._pending)
+
+    def shutdown(self):
+        for lane in self._lanes.values():
+            lane.shutdown(wait=False, cancel_futures=True)
@@ -1,13 +1,23 @@
+import itertools
+import json
 import threading
+import time
 from collections import OrderedDict
 from contextlib import contextmanager
-from typing import Any, List, Tuple, Union
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
 from langchain.embeddings.base import Embeddings
 
-from configs import config
+from configs import config, get_model_options
 
-from ..utils.Logger import log_verbose, logger
+from ..utils.Logger import logger
+from ..utils.metrics import POOL_EVENTS
+
+if TYPE_CHECKING:
+    # torch is imported with the models, only once one is loaded
+    from src.models import EmbeddingModel, RerankerModel
 
 
 class ThreadSafeObject:
@@ -17,6 +27,12 @@ class ThreadSafeObject:
         self._pool = pool
         self._lock = threading.RLock()
         self._loaded = threading.Event()
+        # exception raised by the loader, set instead of `obj` when loading failed
+        self.error = None
+        # estimated bytes held while resident, see `estimate_memory`
+        self.nbytes = 0
+        self.hits = 0
+        self.last_used = time.time()
 
     def __repr__(self) -> str:
         cls = type(self).__name__
@@ -28,25 +44,34 @@ class ThreadSafeObject:
 
     @contextmanager
     def acquire(self, owner: str = "", msg: str = ""):
+        # hot path: no per-call logging, see the pool and latency metrics on /metrics instead
         owner = owner or f"thread {threading.get_native_id()}"
         try:
             self._lock.acquire()
             if self._pool is not None:
-                self._pool._cache.move_to_end(self.key)
-            if log_verbose:
-                logger.info(f"{owner} 开始操作：{self.key}。{msg}")
+                with self._pool.atomic:
+                    if self.key in self._pool._cache:
+                        self._pool._cache.move_to_end(self.key)
+            logger.trace(f"{owner} 开始操作：{self.key}。{msg}")
             yield self._obj
         finally:
-            if log_verbose:
-                logger.info(f"{owner} 结束操作：{self.key}。{msg}")
             self._lock.release()
 
+    @property
+    def loaded(self) -> bool:
+        return self._loaded.is_set()
+
     def start_loading(self):
         self._loaded.clear()
 
     def finish_loading(self):
         self._loaded.set()
 
+    def fail_loading(self, error: BaseException):
+        """Wake the waiters of a failed load, they re-raise `error`."""
+        self.error = error
+        self._loaded.set()
+
     def wait_for_loading(self):
         self._loaded.wait()
 
@@ -60,27 +85,95 @@ class ThreadSafeObject:
 
 
 class CachePool:
-    def __init__(self, cache_num: int = -1):
+    """LRU pool of loaded objects.
+
+    Objects are evicted least recently used first, once more than `cache_num` are resident or their
+    estimated `nbytes` add up to more than `memory_budget` bytes. Pinned keys (or tuple keys whose first
+    element is pinned) and objects still loading are never evicted.
+    """
+
+    def __init__(self, cache_num: int = -1, memory_budget: int = 0, pinned: Iterable[Any] = ()):
         self._cache_num = cache_num
+        self._memory_budget = memory_budget
+        self._pinned = set(pinned)
         self._cache = OrderedDict()
+        self._known_nbytes: Dict[Any, int] = {}
         self.atomic = threading.RLock()
+        self.load_count = 0
+        self.evict_count = 0
 
     def keys(self) -> List[str]:
-        return list(self._cache.keys())
+        with self.atomic:
+            return list(self._cache.keys())
 
-    def _check_count(self):
+    def is_pinned(self, key: Union[str, Tuple]) -> bool:
+        return key in self._pinned or (isinstance(key, tuple) and len(key) > 0 and key[0] in self._pinned)
+
+    def memory_usage(self) -> int:
+        with self.atomic:
+            return sum(item.nbytes for item in self._cache.values())
+
+    def _eviction_candidates(self, protect: Any = None) -> List[Any]:
+        return [
+            key
+            for key, item in self._cache.items()
+            if key != protect and not self.is_pinned(key) and item.loaded
+        ]
+
+    def _evict(self, key: Any):
+        item = self._cache.pop(key)
+        self.evict_count += 1
+        POOL_EVENTS.labels(event="evict").inc()
+        logger.info(f"卸载模型 {key}，释放约 {item.nbytes / 2**20:.0f} MB")
+        self._on_evict(item)
+
+    def _on_evict(self, item: ThreadSafeObject):
+        pass
+
+    def _check_count(self, protect: Any = None):
         if isinstance(self._cache_num, int) and self._cache_num > 0:
-            while len(self._cache) > self._cache_num:
-                self._cache.popitem(last=False)
+            while len(self._cache) > self._cache_num and (candidates := self._eviction_candidates(protect)):
+                self._evict(candidates[0])
+        if self._memory_budget > 0:
+            while self.memory_usage() > self._memory_budget and (candidates := self._eviction_candidates(protect)):
+                self._evict(candidates[0])
+            if self.memory_usage() > self._memory_budget:
+                logger.warning(
+                    f"常驻模型估算占用 {self.memory_usage() / 2**20:.0f} MB，超出预算 {self._memory_budget / 2**20:.0f} MB"
+                )
+
+    def stats(self) -> Dict[str, Any]:
+        with self.atomic:
+            return {
+                "memory_budget_mb": self._memory_budget / 2**20,
+                "memory_used_mb": self.memory_usage() / 2**20,
+                "loads": self.load_count,
+                "evictions": self.evict_count,
+                # least recently used first
+                "models": [
+                    {
+                        "key": list(key) if isinstance(key, tuple) else key,
+                        "memory_mb": item.nbytes / 2**20,
+                        "pinned": self.is_pinned(key),
+                        "loaded": item.loaded,
+                        "hits": item.hits,
+                        "last_used": item.last_used,
+                    }
+                    for key, item in self._cache.items()
+                ],
+            }
 
     def get(self, key: str) -> ThreadSafeObject:
         if cache := self._cache.get(key):
             cache.wait_for_loading()
-            return cache
+            if cache.error is None:
+                return cache
 
     def set(self, key: str, obj: ThreadSafeObject) -> ThreadSafeObject:
+        # reserve what this key took the last time it was loaded, so room is made before loading it
+        obj.nbytes = self._known_nbytes.get(key, 0)
         self._cache[key] = obj
-        self._check_count()
+        self._check_count(protect=key)
         return obj
 
     def pop(self, key: str = None) -> ThreadSafeObject:
@@ -94,49 +187,271 @@ class CachePool:
         if cache is None:
             raise RuntimeError(f"请求的资源 {key} 不存在")
         elif isinstance(cache, ThreadSafeObject):
-            self._cache.move_to_end(key)
+            with self.atomic:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
             return cache.acquire(owner=owner, msg=msg)
         else:
             return cache
 
 
 class EmbeddingsPool(CachePool):
-    def load_embeddings(self, model: str = None, device: str = None) -> Embeddings:
-        self.atomic.acquire()
+    def _load(self, key: Tuple, loader: Callable[[], Any], max_batch_tokens: int = 0) -> Any:
+        """Return the object cached under `key`, building it with `loader` on the first request.
+
+        Concurrent requests for a key being loaded wait for that load, outside of `atomic`. A failed load
+        is removed from the pool and its error raised to every waiter, so the next request retries.
+        """
+        with self.atomic:
+            item = self._cache.get(key)
+            loading = item is None
+            if loading:
+                item = self.set(key, ThreadSafeObject(key, pool=self))
+        if loading:
+            try:
+                with item.acquire(msg="初始化"):
+                    item.obj = loader()
+                    item.nbytes = estimate_memory(item.obj, max_batch_tokens)
+            except BaseException as e:
+                with self.atomic:
+                    if self._cache.get(key) is item:
+                        self._cache.pop(key)
+                logger.error(f"加载模型 {key} 失败：{e}")
+                item.fail_loading(e)
+                raise
+            item.finish_loading()
+            with self.atomic:
+                self.load_count += 1
+                POOL_EVENTS.labels(event="load").inc()
+                self._known_nbytes[key] = item.nbytes
+                self._check_count(protect=key)
+        else:
+            item.wait_for_loading()
+            if item.error is not None:
+                raise item.error
+        with self.atomic:
+            if self._cache.get(key) is not item:
+                # evicted by a concurrent load in the meantime
+                item = None
+            else:
+                self._cache.move_to_end(key)
+        if item is None:
+            return self._load(key, loader, max_batch_tokens)
+        item.hits += 1
+        item.last_used = time.time()
+        return item.obj
+
+    def load_embeddings(self, model: str = None, device: str = None) -> Union[Embeddings, "EmbeddingModel"]:
         model = model or config.embedding.default
         device = config.embedding.device
-        key = (model, device)
-        if not self.get(key):
-            item = ThreadSafeObject(key, pool=self)
-            self.set(key, item)
-            with item.acquire(msg="初始化"):
-                self.atomic.release()
-                if "bge-" in model:
-                    from langchain_community.embeddings import HuggingFaceBgeEmbeddings
-
-                    if "zh" in model:
-                        # for chinese model
-                        query_instruction = "为这个句子生成表示以用于检索相关文章："
-                    elif "en" in model:
-                        # for english model
-                        query_instruction = "Represent this sentence for searching relevant passages:"
-                    else:
-                        # maybe ReRanker or else, just use empty string instead
-                        query_instruction = ""
-                    embeddings = HuggingFaceBgeEmbeddings(
-                        model_name=model, model_kwargs={"device": device}, query_instruction=query_instruction
-                    )
-                    if model == "bge-large-zh-noinstruct":  # bge large -noinstruct embedding
-                        embeddings.query_instruction = ""
-                else:
-                    from langchain.embeddings.huggingface import HuggingFaceEmbeddings
-
-                    embeddings = HuggingFaceEmbeddings(model_name=model, model_kwargs={"device": device})
-                item.obj = embeddings
-                item.finish_loading()
+        return self._load(
+            (model, device),
+            partial(self._build_embeddings, model, device),
+            max_batch_tokens=max_batch_tokens(get_model_options("embedding", model)),
+        )
+
+    def load_reranker(self, model: str = None, device: str = None) -> "RerankerModel":
+        model = model or config.reranker.default
+        device = config.reranker.device
+        return self._load(
+            (model, device, "reranker"),
+            partial(self._build_reranker, model, device),
+            max_batch_tokens=max_batch_tokens(get_model_options("reranker", model)),
+        )
+
+    def _on_evict(self, item: ThreadSafeObject):
+        import torch
+
+        if hasattr(item.obj, "close"):
+            # a ReplicatedModel's worker threads hold every replica until they are stopped
+            item.obj.close()
+        item.obj = None
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    @staticmethod
+    def _build_embeddings(model: str, device: str) -> Union[Embeddings, "EmbeddingModel"]:
+        options = get_model_options("embedding", model)
+        backend = options["backend"]
+        pooler = resolve_pooler(model, options["pooler"])
+        if backend in ("native", "onnx") and pooler is None:
+            logger.warning(f"{model} 的 sentence-transformers 池化方式 native / onnx 后端不支持，改用 langchain 后端")
+            backend = "langchain"
+        if backend == "native":
+            from src.models import EmbeddingModel, ReplicatedModel
+
+            build = partial(
+                EmbeddingModel,
+                model_name_or_path=model,
+                pooler=pooler,
+                use_fp16=options["use_fp16"],
+                quantize=options["quantize"] or None,
+            )
+            if devices := replica_devices(device, options["parallel"]):
+                embeddings = ReplicatedModel(lambda d: build(device=d), devices)
+            else:
+                embeddings = build(device=device)
+        elif backend == "onnx":
+            from src.models import ORTEmbeddingModel
+
+            embeddings = ORTEmbeddingModel(
+                model_name_or_path=model,
+                pooler=pooler,
+                num_threads=options["onnx_num_threads"],
+                cache_dir=options["onnx_cache_dir"] or None,
+            )
+        elif "bge-" in model:
+            from langchain_community.embeddings import HuggingFaceBgeEmbeddings
+
+            if "zh" in model:
+                # for chinese model
+                query_instruction = "为这个句子生成表示以用于检索相关文章："
+            elif "en" in model:
+                # for english model
+                query_instruction = "Represent this sentence for searching relevant passages:"
+            else:
+                # maybe ReRanker or else, just use empty string instead
+                query_instruction = ""
+            embeddings = HuggingFaceBgeEmbeddings(
+                model_name=model,
+                model_kwargs={"device": device},
+                encode_kwargs={"normalize_embeddings": options["normalize"]},
+                query_instruction=query_instruction,
+            )
+            if model == "bge-large-zh-noinstruct":  # bge large -noinstruct embedding
+                embeddings.query_instruction = ""
         else:
-            self.atomic.release()
-        return self.get(key).obj
+            from langchain.embeddings.huggingface import HuggingFaceEmbeddings
+
+            embeddings = HuggingFaceEmbeddings(
+                model_name=model,
+                model_kwargs={"device": device},
+                encode_kwargs={"normalize_embeddings": options["normalize"]},
+            )
+        return embeddings
+
+    @staticmethod
+    def _build_reranker(model: str, device: str) -> "RerankerModel":
+        from src.models import ReplicatedModel, RerankerModel
+
+        options = get_model_options("reranker", model)
+        build = partial(
+            RerankerModel,
+            model_name_or_path=model,
+            use_fp16=options["use_fp16"],
+            quantize=options["quantize"] or None,
+        )
+        if devices := replica_devices(device, options["parallel"]):
+            return ReplicatedModel(lambda d: build(device=d), devices)
+        return build(device=device)
+
+
+def replica_devices(device: str, parallel: str) -> List[str]:
+    """GPUs to hold one model copy each, when `device` is "cuda", several GPUs are visible and
+    `parallel` is "replica"; an empty list means a single model on `device`."""
+    import torch
+
+    if device == "cuda" and parallel == "replica" and torch.cuda.device_count() > 1:
+        return [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+    return []
+
+
+def max_batch_tokens(options: Dict[str, Any]) -> int:
+    """Largest number of padded tokens a single forward pass may see with these options"""
+    return options.get("max_tokens_per_batch") or options["batch_size"] * options["max_length"]
+
+
+def estimate_memory(obj: Any, max_batch_tokens: int = 0) -> int:
+    """Estimate the bytes a loaded model holds: parameters and buffers plus the activations of one
+    forward pass over `max_batch_tokens` padded tokens (hidden states, FFN intermediate and attention
+    scores of a layer, which are freed layer by layer)."""
+    import torch
+
+    if hasattr(obj, "replicas"):
+        return sum(estimate_memory(replica, max_batch_tokens) for replica in obj.replicas)
+    module = getattr(obj, "model", None) or getattr(obj, "client", None)
+    # unwrap torch.nn.DataParallel
+    module = getattr(module, "module", module)
+    if not isinstance(module, torch.nn.Module):
+        # e.g. an ONNX Runtime session, which reports the size of its weights
+        return getattr(obj, "weights_nbytes", 0)
+
+    tensors = list(itertools.chain(module.parameters(), module.buffers()))
+    weights = sum(t.numel() * t.element_size() for t in tensors)
+    model_config = next(
+        (m.config for m in module.modules() if hasattr(getattr(m, "config", None), "hidden_size")), None
+    )
+    if model_config is None or not tensors:
+        return weights
+    hidden = model_config.hidden_size
+    intermediate = getattr(model_config, "intermediate_size", 4 * hidden)
+    heads = getattr(model_config, "num_attention_heads", 0)
+    max_positions = getattr(model_config, "max_position_embeddings", 512)
+    per_token = 3 * hidden + intermediate + heads * max_positions
+    return weights + max_batch_tokens * per_token * tensors[0].element_size()
+
+
+# sentence-transformers pooling modes (`pooling_mode_<mode>` in 1_Pooling/config.json) and their native pooler
+ST_POOLING_MODES = {
+    "cls_token": "cls",
+    "mean_tokens": "mean",
+    "max_tokens": None,
+    "mean_sqrt_len_tokens": None,
+    "weightedmean_tokens": None,
+    "lasttoken": None,
+}
+
+
+@lru_cache(maxsize=32)
+def sentence_transformers_pooling(model: str) -> Optional[str]:
+    """Pooling mode declared by a sentence-transformers model, None for models without `1_Pooling/config.json`
+    or when the hub cannot tell."""
+    path = Path(model) / "1_Pooling" / "config.json"
+    if not path.exists():
+        if Path(model).is_dir():
+            # a local model without sentence-transformers config, not a hub repo id
+            return None
+        from huggingface_hub import hf_hub_download
+        from huggingface_hub.utils import EntryNotFoundError, HFValidationError, HfHubHTTPError, RepositoryNotFoundError
+
+        try:
+            path = hf_hub_download(model, "1_Pooling/config.json")
+        except (EntryNotFoundError, RepositoryNotFoundError):
+            return None
+        except (HFValidationError, HfHubHTTPError, OSError) as e:
+            logger.warning(f"无法获取 {model} 的 sentence-transformers 池化配置，按默认 cls 处理：{e}")
+            return None
+    pooling = json.loads(Path(path).read_text())
+    return next((mode for mode in ST_POOLING_MODES if pooling.get(f"pooling_mode_{mode}")), None)
+
+
+def resolve_pooler(model: str, pooler: str) -> Optional[str]:
+    """Native pooler of `model`: `pooler` unless it is "auto", then the one its sentence-transformers config
+    declares ("cls" without one). None when that pooling only runs through the langchain backend."""
+    if pooler != "auto":
+        return pooler
+    mode = sentence_transformers_pooling(model)
+    return "cls" if mode is None else ST_POOLING_MODES[mode]
+
+
+@lru_cache(maxsize=8)
+def load_tokenizer(model: str = None):
+    """Load only the tokenizer of a model, for token accounting without inference."""
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(model or config.embedding.default)
+
+
+@lru_cache(maxsize=32)
+def embedding_dimension(model: str = None) -> int:
+    """Hidden size of a model, read from its config without loading the weights."""
+    from transformers import AutoConfig
+
+    return AutoConfig.from_pretrained(model or config.embedding.default).hidden_size
 
 
-embeddings_pool = EmbeddingsPool(cache_num=1)
+embeddings_pool = EmbeddingsPool(
+    cache_num=config.pool.max_models,
+    memory_budget=int(config.pool.memory_budget_mb * 2**20),
+    pinned=config.pool.pinned,
+)
@@ -12,6 +12,8 @@ import argparse
 import asyncio
 import json
 import os
+import time
+from functools import lru_cache
 from typing import Any, Dict, Generator, List, Optional, Union
 
 import aiohttp
@@ -67,22 +69,36 @@ from src.utils.Logger import logger
 conv_template_map = {}
 
 fetch_timeout = aiohttp.ClientTimeout(total=3 * 3600)
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """The gateway's long-lived client session, whose connection pool is shared by all calls to the controller and workers."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=app_settings.max_connections, keepalive_timeout=60)
+        _session = aiohttp.ClientSession(connector=connector, timeout=fetch_timeout)
+    return _session
+
+
+async def close_session():
+    if _session is not None and not _session.closed:
+        await _session.close()
 
 
 async def fetch_remote(url, pload=None, name=None):
-    async with aiohttp.ClientSession(timeout=fetch_timeout) as session:
-        async with session.post(url, json=pload) as response:
-            chunks = []
-            if response.status != 200:
-                ret = {
-                    "text": f"{response.reason}",
-                    "error_code": ErrorCode.INTERNAL_ERROR,
-                }
-                return json.dumps(ret)
-
-            async for chunk, _ in response.content.iter_chunks():
-                chunks.append(chunk)
-        output = b"".join(chunks)
+    async with get_session().post(url, json=pload) as response:
+        chunks = []
+        if response.status != 200:
+            ret = {
+                "text": f"{response.reason}",
+                "error_code": ErrorCode.INTERNAL_ERROR,
+            }
+            return json.dumps(ret)
+
+        async for chunk, _ in response.content.iter_chunks():
+            chunks.append(chunk)
+    output = b"".join(chunks)
 
     if name is not None:
         res = json.loads(output)
@@ -97,9 +113,67 @@ class AppSettings(BaseSettings):
     # The address of the model controller.
     controller_address: str = "http://localhost:21001"
     api_keys: Optional[List[str]] = None
+    # seconds a fetched model list is served before it is refreshed in the background
+    model_list_ttl: float = 30
+    max_connections: int = 100
+
+
+class ModelRegistry:
+    """Model list of the controller, cached for `ttl` seconds.
+
+    A stale list is still served while one background task refreshes it (asking the controller to refresh
+    its workers first), so requests only wait for the controller before the first list arrives, or when
+    they name an unknown model and the list is older than `min_refresh_interval` seconds.
+    """
+
+    def __init__(self, ttl: float, min_refresh_interval: float = 1):
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.models: Optional[List[str]] = None
+        self.updated_at = 0.0
+        self._refreshing: Optional[asyncio.Task] = None
+
+    async def refresh(self, refresh_workers: bool = True) -> List[str]:
+        controller_address = app_settings.controller_address
+        if refresh_workers:
+            await fetch_remote(controller_address + "/refresh_all_workers")
+        models = await fetch_remote(controller_address + "/list_models", None, "models")
+        self.models = sorted(models)
+        self.updated_at = time.monotonic()
+        return self.models
+
+    def _refresh_in_background(self) -> asyncio.Task:
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self.refresh())
+            self._refreshing.add_done_callback(self._log_failure)
+        return self._refreshing
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"刷新模型列表失败：{task.exception()}")
+
+    async def get(self) -> List[str]:
+        if self.models is None:
+            return await self.refresh(refresh_workers=False)
+        if time.monotonic() - self.updated_at > self.ttl:
+            self._refresh_in_background()
+        return self.models
+
+    async def contains(self, model: str) -> bool:
+        if model in await self.get():
+            return True
+        if time.monotonic() - self.updated_at > self.min_refresh_interval:
+            # the model may have been registered since the last refresh
+            try:
+                await asyncio.shield(self._refresh_in_background())
+            except Exception:
+                pass  # logged by `_log_failure`, answer from the cached list
+        return model in self.models
 
 
 app_settings = AppSettings()
+model_registry = ModelRegistry(ttl=app_settings.model_list_ttl)
 app = fastapi.FastAPI()
 headers = {"User-Agent": "FastChat API Server"}
 get_bearer_token = HTTPBearer(auto_error=False)
@@ -127,8 +201,8 @@ async def check_api_key(
         return None
 
 
-def create_error_response(code: int, message: str) -> JSONResponse:
-    return JSONResponse(ErrorResponse(message=message, code=code).dict(), status_code=400)
+def create_error_response(code: int, message: str, status_code: int = 400) -> JSONResponse:
+    return JSONResponse(ErrorResponse(message=message, code=code).dict(), status_code=status_code)
 
 
 @app.exception_handler(RequestValidationError)
@@ -137,25 +211,20 @@ async def validation_exception_handler(request, exc):
 
 
 async def check_model(request) -> Optional[JSONResponse]:
-    controller_address = app_settings.controller_address
     ret = None
 
-    models = await fetch_remote(controller_address + "/list_models", None, "models")
-    if request.model not in models:
+    if not await model_registry.contains(request.model):
         ret = create_error_response(
             ErrorCode.INVALID_MODEL,
-            f"Only {'&&'.join(models)} allowed now, your model {request.model}",
+            f"Only {'&&'.join(model_registry.models)} allowed now, your model {request.model}",
         )
     return ret
 
 
 @app.get("/v1/models", dependencies=[Depends(check_api_key)])
 async def show_available_models():
-    controller_address = app_settings.controller_address
-    ret = await fetch_remote(controller_address + "/refresh_all_workers")
-    models = await fetch_remote(controller_address + "/list_models", None, "models")
+    models = await model_registry.get()
 
-    models.sort()
     # TODO: return real model permission details
     model_cards = []
     for m in models:
@@ -163,26 +232,53 @@ async def show_available_models():
     return ModelList(data=model_cards)
 
 
-def process_input(model_name, inp):
+@lru_cache(maxsize=32)
+def get_tiktoken_encoding(model_name: Optional[str]) -> tiktoken.Encoding:
+    """tiktoken encoding of `model_name`, cl100k_base for unknown models.
+
+    Keyed by the client's model name, so the cache is bounded; tiktoken itself keeps one instance per encoding.
+    """
+    if model_name is None:
+        return tiktoken.get_encoding("cl100k_base")
+    try:
+        return tiktoken.model.encoding_for_model(model_name)
+    except KeyError:
+        logger.warning(f"Warning: model {model_name} not found. Using cl100k_base encoding.")
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def is_token_id(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def process_input(model_name, inp, native_token_ids: bool = False, vocab_size: Optional[int] = None):
+    """Normalize an embeddings `input` into a list.
+
+    `inp` is a string, a list of strings, a list of token ids or a list of token id lists, anything else
+    (mixed items, floats, ...) raises `ValueError`. Token id inputs are decoded to text in one `decode_batch`
+    call, unless `native_token_ids`: then they are ids of the serving model's own tokenizer and are returned
+    as id lists, to be fed to the model as they are. Ids outside the vocabulary (`vocab_size` for native ids)
+    raise `ValueError`.
+    """
     if isinstance(inp, str):
         inp = [inp]
-    elif isinstance(inp, list):
-        if isinstance(inp[0], int):
-            try:
-                decoding = tiktoken.model.encoding_for_model(model_name)
-            except KeyError:
-                logger.warning("Warning: model not found. Using cl100k_base encoding.")
-                model = "cl100k_base"
-                decoding = tiktoken.get_encoding(model)
-            inp = [decoding.decode(inp)]
-        elif isinstance(inp[0], list):
-            try:
-                decoding = tiktoken.model.encoding_for_model(model_name)
-            except KeyError:
-                logger.warning("Warning: model not found. Using cl100k_base encoding.")
-                model = "cl100k_base"
-                decoding = tiktoken.get_encoding(model)
-            inp = [decoding.decode(text) for text in inp]
+    elif isinstance(inp, list) and len(inp) > 0:
+        if all(isinstance(item, str) for item in inp):
+            return inp
+        if all(is_token_id(item) for item in inp):
+            inp = [inp]
+        elif not all(isinstance(ids, list) and all(is_token_id(i) for i in ids) for ids in inp):
+            raise ValueError(
+                "input should be a string, a list of strings, a list of token ids or a list of token id lists"
+            )
+        encoding = None if native_token_ids else get_tiktoken_encoding(model_name)
+        limit = vocab_size if native_token_ids else encoding.n_vocab
+        if limit is not None:
+            for index, ids in enumerate(inp):
+                if ids and (min(ids) < 0 or max(ids) >= limit):
+                    raise ValueError(f"input[{index}] contains token ids outside the vocabulary [0, {limit})")
+        if not native_token_ids:
+            inp = encoding.decode_batch(inp)
 
     return inp
 
@@ -197,7 +293,10 @@ async def create_embeddings(request: EmbeddingsRequest, model_name: str = None):
     if error_check_ret is not None:
         return error_check_ret
 
-    request.input = process_input(request.model, request.input)
+    try:
+        request.input = process_input(request.model, request.input)
+    except ValueError as e:
+        return create_error_response(ErrorCode.PARAM_OUT_OF_RANGE, str(e))
 
     data = []
     token_num = 0
@@ -375,6 +474,7 @@ def create_openai_api_server():
     )
     app_settings.controller_address = args.controller_address
     app_settings.api_keys = args.api_keys
+    app.add_event_handler("shutdown", close_session)
 
     logger.info(f"args: {args}")
     return args
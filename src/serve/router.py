@@ -0,0 +1,265 @@
+"""Local router in front of several KEngine workers on one host, replacing the FastChat controller.
+
+Workers (started with `[router] address` set) announce themselves with periodic heartbeats listing the
+models they hold. The router forwards every API request to a live worker, preferring the ones that
+already hold the requested model and, among those, the one with the fewest requests in flight.
+
+Usage:
+python -m src.serve.router --port 8000
+python startup.py --port 8081  # with [router] address = "http://127.0.0.1:8000"
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+import aiohttp
+import uvicorn
+from fastapi import FastAPI, Request
+from pydantic import BaseModel
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+sys.path.append(Path(__file__).parents[2].as_posix())
+from configs import config
+from src.utils.Logger import logger
+
+# request headers forwarded to workers
+FORWARDED_HEADERS = ("authorization", "content-type", "accept")
+# worker response headers not relayed to clients: hop-by-hop ones, those describing the body as aiohttp
+# received it (it is decompressed and re-framed here), and those the router's own server sets
+DROPPED_RESPONSE_HEADERS = (
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+    "content-length",
+    "content-encoding",
+    "content-type",
+    "date",
+    "server",
+)
+
+
+class Heartbeat(BaseModel):
+    address: str
+    # names of the embedding / reranker models the worker holds
+    models: List[str] = []
+    ready: bool = True
+    # requests the worker is processing, from all its clients
+    outstanding: int = 0
+
+
+@dataclass
+class WorkerState:
+    address: str
+    models: Set[str] = field(default_factory=set)
+    ready: bool = True
+    reported_outstanding: int = 0
+    # requests this router has in flight on the worker
+    outstanding: int = 0
+    last_seen: float = field(default_factory=time.monotonic)
+
+    @property
+    def load(self) -> int:
+        return max(self.outstanding, self.reported_outstanding)
+
+
+class WorkerRegistry:
+    """Workers known from heartbeats; those silent for `expiry` seconds are dropped."""
+
+    def __init__(self, expiry: float):
+        self.expiry = expiry
+        self.workers: Dict[str, WorkerState] = {}
+
+    def heartbeat(self, beat: Heartbeat):
+        worker = self.workers.get(beat.address)
+        if worker is None:
+            worker = self.workers[beat.address] = WorkerState(beat.address)
+            logger.info(f"worker {beat.address} 上线，模型：{beat.models}")
+        worker.models = set(beat.models)
+        worker.ready = beat.ready
+        worker.reported_outstanding = beat.outstanding
+        worker.last_seen = time.monotonic()
+
+    def live(self) -> List[WorkerState]:
+        now = time.monotonic()
+        for address in [a for a, w in self.workers.items() if now - w.last_seen > self.expiry]:
+            logger.warning(f"worker {address} 心跳超时，已移除")
+            del self.workers[address]
+        return [worker for worker in self.workers.values() if worker.ready]
+
+    def choose(self, model: Optional[str]) -> Optional[WorkerState]:
+        """Least loaded live worker, among those holding `model` when any does."""
+        workers = self.live()
+        if model is not None:
+            workers = [w for w in workers if model in w.models] or workers
+        return min(workers, key=lambda w: w.load, default=None)
+
+    def models(self) -> List[str]:
+        return sorted({model for worker in self.live() for model in worker.models})
+
+    def stats(self) -> List[dict]:
+        now = time.monotonic()
+        return [
+            {
+                "address": w.address,
+                "models": sorted(w.models),
+                "ready": w.ready,
+                "outstanding": w.outstanding,
+                "reported_outstanding": w.reported_outstanding,
+                "seconds_since_heartbeat": now - w.last_seen,
+            }
+            for w in self.workers.values()
+        ]
+
+
+def request_model(body: bytes, content_type: str) -> Optional[str]:
+    """`model` of a JSON request body, None for other bodies."""
+    if not body or not content_type.startswith("application/json"):
+        return None
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return None
+    return payload.get("model") if isinstance(payload, dict) else None
+
+
+def create_router_app() -> FastAPI:
+    app = FastAPI(title="KEngine Router")
+    registry = WorkerRegistry(expiry=config.router.heartbeat_expiry)
+    session: Dict[str, aiohttp.ClientSession] = {}
+
+    @app.on_event("startup")
+    async def open_session():
+        connector = aiohttp.TCPConnector(limit=config.router.max_connections, keepalive_timeout=60)
+        session["client"] = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=3 * 3600))
+
+    @app.on_event("shutdown")
+    async def close_session():
+        await session["client"].close()
+
+    @app.post("/router/heartbeat", include_in_schema=False)
+    async def heartbeat(beat: Heartbeat):
+        registry.heartbeat(beat)
+        return {"status": "ok"}
+
+    @app.get("/router/workers", tags=["router"], summary="已注册的 worker 及负载")
+    async def workers():
+        return registry.stats()
+
+    @app.get("/v1/models", tags=["router"], summary="所有在线 worker 的模型")
+    async def models():
+        return {"object": "list", "data": [{"id": m, "object": "model", "owned_by": "kengine"} for m in registry.models()]}
+
+    @app.get("/health/ready", tags=["router"], summary="至少一个 worker 在线时返回 200")
+    async def ready():
+        live = registry.live()
+        return JSONResponse({"workers": len(live)}, status_code=200 if live else 503)
+
+    @app.api_route("/v1/{path:path}", methods=["GET", "POST"], include_in_schema=False)
+    async def proxy(path: str, request: Request):
+        body = await request.body()
+        model = request_model(body, request.headers.get("content-type", ""))
+        worker = registry.choose(model)
+        if worker is None:
+            return JSONResponse({"object": "error", "message": "no KEngine worker available"}, status_code=503)
+
+        worker.outstanding += 1
+        upstream, relayed = None, False
+        try:
+            try:
+                upstream = await session["client"].request(
+                    request.method,
+                    f"{worker.address}/v1/{path}",
+                    params=request.query_params,
+                    data=body,
+                    headers={k: v for k, v in request.headers.items() if k.lower() in FORWARDED_HEADERS},
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"转发到 {worker.address} 失败：{e!r}")
+                return JSONResponse({"object": "error", "message": f"worker {worker.address} unreachable"}, status_code=502)
+
+            # e.g. Retry-After of a worker's 429, besides its X- headers
+            headers = {k: v for k, v in upstream.headers.items() if k.lower() not in DROPPED_RESPONSE_HEADERS}
+            if upstream.content_type == "application/x-ndjson":
+
+                async def relay():
+                    # the request stays outstanding until the whole stream is relayed
+                    try:
+                        async for chunk in upstream.content.iter_any():
+                            yield chunk
+                    finally:
+                        upstream.release()
+                        worker.outstanding -= 1
+
+                response = StreamingResponse(relay(), status_code=upstream.status, media_type=upstream.content_type, headers=headers)
+                # from here on `relay` releases the connection and the outstanding count
+                relayed = True
+                return response
+
+            content = await upstream.read()
+            return Response(content, status_code=upstream.status, media_type=upstream.content_type, headers=headers)
+        finally:
+            # also reached on client disconnects (CancelledError) and timeouts
+            if not relayed:
+                if upstream is not None:
+                    upstream.release()
+                worker.outstanding -= 1
+
+    return app
+
+
+async def heartbeat_loop(address: str):
+    """Worker side: announce `address` and the models held in this process to the router, forever."""
+    from .model_worker import embeddings_pool
+    from .utils import inference_executor
+    from .warmup import readiness
+
+    url = config.router.address.rstrip("/") + "/router/heartbeat"
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=config.router.heartbeat_interval)) as session:
+        while True:
+            # pool keys are (model, device[, "reranker"])
+            models = sorted({key[0] if isinstance(key, tuple) else key for key in embeddings_pool.keys()})
+            beat = {
+                "address": address,
+                "models": models,
+                "ready": readiness.ready,
+                "outstanding": sum(inference_executor.stats().values()),
+            }
+            try:
+                async with session.post(url, json=beat) as response:
+                    response.raise_for_status()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.debug(f"心跳发送失败：{e}")
+            await asyncio.sleep(config.router.heartbeat_interval)
+
+
+_heartbeat_task: Optional[asyncio.Task] = None
+
+
+def start_heartbeat(port: int):
+    """Startup hook of a worker app, when `[router] address` is set."""
+    global _heartbeat_task
+    address = f"http://{config.router.advertise_host}:{port}"
+    _heartbeat_task = asyncio.get_running_loop().create_task(heartbeat_loop(address))
+    logger.info(f"向路由 {config.router.address} 注册为 {address}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="KEngine local router")
+    parser.add_argument("--host", default=config.router.host, type=str, help="Host address")
+    parser.add_argument("--port", default=config.router.port, type=int, help="Port number")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    uvicorn.run(create_router_app(), host=args.host, port=args.port)
@@ -0,0 +1,230 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..utils.Logger import logger
+from ..utils.metrics import QUEUE_WAIT
+from .admission import RequestTooLargeError
+from .executor import EngineOverloadedError
+
+
+@dataclass
+class PendingItem:
+    """A slice of one request's input waiting to be merged into a batch."""
+
+    payload: Dict[str, Any]
+    future: asyncio.Future = field(repr=False)
+    enqueued_at: float = field(default_factory=time.perf_counter, repr=False)
+
+    @property
+    def size(self) -> int:
+        return len(self.payload["input"])
+
+
+class _RoundRobin:
+    """Deque-like store of pending items taking turns between tenants (``payload["tenant"]``)."""
+
+    def __init__(self):
+        self._tenants: Dict[Any, deque] = OrderedDict()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, item: PendingItem):
+        self._tenants.setdefault(item.payload.get("tenant"), deque()).append(item)
+        self._size += 1
+
+    def popleft(self) -> PendingItem:
+        tenant, items = next(iter(self._tenants.items()))
+        item = items.popleft()
+        if items:
+            # the tenant's remaining items wait behind every other tenant's next item
+            self._tenants.move_to_end(tenant)
+        else:
+            del self._tenants[tenant]
+        self._size -= 1
+        return item
+
+
+class FairQueue(asyncio.Queue):
+    """``asyncio.Queue`` handing out pending items round-robin across tenants, so one tenant's large
+    request is interleaved with, not ahead of, other tenants' requests."""
+
+    def _init(self, maxsize):
+        self._queue = _RoundRobin()
+
+
+class BatchScheduler:
+    """Gather pending inputs from concurrent requests into shared batches.
+
+    Requests that agree on every payload field except ``input`` (model name, query instruction, ...)
+    share a queue. A background task per queue takes the first pending item, keeps collecting until
+    ``max_batch_size`` inputs are gathered or ``max_wait_ms`` has elapsed, runs ``runner`` once on the
+    merged payload and hands each request back its own slice of the result. Up to ``max_inflight``
+    batches of a queue run at once, so the next batch is formed while one is computing and replicated
+    models get one batch per replica. Items of a queue are taken round-robin across tenants. At most ``max_pending`` inputs may wait in the queues; requests
+    beyond that are rejected with ``EngineOverloadedError``, and a single request larger than that, which no
+    retry would fit, with ``RequestTooLargeError``.
+    """
+
+    # result fields holding one entry per input, split back to the requests of a batch
+    PER_INPUT_FIELDS = ("embedding", "scales", "token_nums")
+    # seconds without input after which a queue's batch loop exits, so client-chosen options (e.g.
+    # `dimensions`) do not leave a task and a queue behind for every value ever requested
+    IDLE_TIMEOUT = 60
+    # payload fields that do not change the result, so requests differing in them share batches
+    NON_KEY_FIELDS = ("input", "tenant")
+
+    def __init__(
+        self,
+        runner: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5,
+        max_pending: int = 0,
+        max_inflight: int = 1,
+    ):
+        self.runner = runner
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_pending = max_pending
+        self.max_inflight = max_inflight
+        self.pending = 0
+        self._queues: Dict[Tuple, asyncio.Queue] = {}
+        self._workers: Dict[Tuple, asyncio.Task] = {}
+
+    @classmethod
+    def batch_key(cls, payload: Dict[str, Any]) -> Tuple:
+        return tuple(sorted((k, v) for k, v in payload.items() if k not in cls.NON_KEY_FIELDS))
+
+    def _get_queue(self, key: Tuple) -> asyncio.Queue:
+        if key not in self._queues:
+            self._queues[key] = FairQueue()
+        worker = self._workers.get(key)
+        if worker is None or worker.done():
+            self._workers[key] = asyncio.create_task(self._batch_loop(key, self._queues[key]))
+        return self._queues[key]
+
+    async def submit(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Embed ``payload["input"]`` as part of shared batches and return the merged result for it."""
+        inputs = payload["input"]
+        if self.max_pending > 0 and len(inputs) > self.max_pending:
+            raise RequestTooLargeError(
+                f"batch too large: {len(inputs)} inputs exceed the limit of {self.max_pending} queued inputs, split the request"
+            )
+        if self.max_pending > 0 and self.pending + len(inputs) > self.max_pending:
+            raise EngineOverloadedError(f"{self.pending} inputs are already waiting to be embedded")
+        queue = self._get_queue(self.batch_key(payload))
+        loop = asyncio.get_running_loop()
+        futures = []
+        for i in range(0, len(inputs), self.max_batch_size):
+            item = PendingItem(payload={**payload, "input": inputs[i : i + self.max_batch_size]}, future=loop.create_future())
+            queue.put_nowait(item)
+            futures.append(item.future)
+        self.pending += len(inputs)
+
+        try:
+            results = await asyncio.gather(*futures)
+        finally:
+            self.pending -= len(inputs)
+        for result in results:
+            if result.get("error_code", 0) != 0:
+                return result
+        merged = {"error_code": 0, "text": ""}
+        for name in self.PER_INPUT_FIELDS:
+            if results and results[0].get(name) is not None:
+                if isinstance(results[0][name], np.ndarray):
+                    merged[name] = np.concatenate([result[name] for result in results])
+                else:
+                    merged[name] = [value for result in results for value in result[name]]
+        return merged
+
+    async def _collect(self, queue: asyncio.Queue, first: PendingItem) -> Tuple[List[PendingItem], Optional[PendingItem]]:
+        """Collect items after ``first`` until the batch is full or the wait window closes.
+
+        Returns the batch and the item that did not fit, which opens the next batch.
+        """
+        batch, size = [first], first.size
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while size < self.max_batch_size:
+            if queue.empty():
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = queue.get_nowait()
+            if item.future.done():
+                # the request was cancelled while waiting
+                continue
+            if size + item.size > self.max_batch_size:
+                return batch, item
+            batch.append(item)
+            size += item.size
+        return batch, None
+
+    async def _batch_loop(self, key: Tuple, queue: asyncio.Queue):
+        inflight = asyncio.Semaphore(self.max_inflight)
+        running = set()
+        carry = None
+        while True:
+            if carry is None:
+                try:
+                    first = await asyncio.wait_for(queue.get(), self.IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if queue.empty():
+                        # no await until return, so no request can enqueue into the dropped queue
+                        del self._queues[key]
+                        del self._workers[key]
+                        return
+                    continue
+            else:
+                first = carry
+            if first.future.done():
+                carry = None
+                continue
+            batch, carry = await self._collect(queue, first)
+            await inflight.acquire()
+            task = asyncio.create_task(self._run_batch(batch))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            task.add_done_callback(lambda _: inflight.release())
+
+    async def _run_batch(self, batch: List[PendingItem]):
+        started = time.perf_counter()
+        for item in batch:
+            QUEUE_WAIT.labels(stage="batching").observe(started - item.enqueued_at)
+        payload = {**batch[0].payload, "input": [text for item in batch for text in item.payload["input"]]}
+        try:
+            result = await self.runner(payload)
+        except Exception as e:
+            logger.exception(f"Batch of {len(payload['input'])} inputs failed: {e}")
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+
+        offset = 0
+        for item in batch:
+            if not item.future.done():
+                if result.get("error_code", 0) != 0:
+                    item.future.set_result(result)
+                else:
+                    item.future.set_result(
+                        {
+                            **result,
+                            **{
+                                name: result[name][offset : offset + item.size]
+                                for name in self.PER_INPUT_FIELDS
+                                if result.get(name) is not None
+                            },
+                        }
+                    )
+            offset += item.size
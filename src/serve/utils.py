@@ -1,16 +1,51 @@
 import argparse
+import asyncio
+import base64
 import json
+import math
+import time
+from collections import deque
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-from starlette.responses import RedirectResponse
+import numpy as np
+from fastapi import Depends
+from starlette.requests import Request
+from starlette.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 
-from configs import config
-from src.serve.model_worker import embeddings_pool
+from configs import config, get_model_options
+from src.models import EmbeddingModel, ReplicatedModel
+from src.models.utils import OUTPUT_DTYPES, cast_embeddings, count_tokens
+from src.protocol.api_protocol import (
+    ErrorCode,
+    RerankRequest,
+    RerankResponse,
+    RerankResult,
+    TokenCountItem,
+    TokenCountRequest,
+    TokenCountResponse,
+)
+from src.serve.admission import ANONYMOUS, RateLimitedError, RequestTooLargeError, admission, estimate_tokens
+from src.serve.embedding_cache import EmbeddingCache
+from src.serve.executor import EngineOverloadedError, InferenceExecutor
+from src.serve.model_worker import embedding_dimension, embeddings_pool, load_tokenizer, resolve_pooler
+from src.serve.scheduler import BatchScheduler
+from src.serve.warmup import readiness
+from src.utils import logger
+from src.utils.metrics import (
+    LANE_LATENCY,
+    REQUESTS,
+    SERIALIZE_TIME,
+    SLO_VIOLATIONS,
+    TOKENS,
+    render_metrics,
+    timed,
+)
+from src.protocol.openai_api_protocol import EmbeddingsRequest
 from src.serve.openai_api_server import (
-    EmbeddingsRequest,
     EmbeddingsResponse,
     UsageInfo,
+    check_api_key,
     create_error_response,
     process_input,
 )
@@ -20,6 +55,9 @@ def parse_args():
     parser = argparse.ArgumentParser(description="KEngine Embedding Server")
     parser.add_argument("--host", default=config.server.host, type=str, help="Host address")
     parser.add_argument("--port", default=config.server.port, type=int, help="Port number")
+    parser.add_argument(
+        "--workers", default=config.server.workers, type=int, help="Number of worker processes sharing the port"
+    )
     parser.add_argument("--allow-credentials", type=bool, default=True, help="allow credentials")
     parser.add_argument("--allowed-origins", type=json.loads, default=["*"], help="allowed origins")
     parser.add_argument("--allowed-methods", type=json.loads, default=["*"], help="allowed methods")
@@ -38,46 +76,557 @@ async def document():
     return RedirectResponse(url="/docs")
 
 
+inference_executor = InferenceExecutor(
+    max_queue=config.inference.max_queue,
+    workers_per_device=config.inference.workers_per_device,
+)
+
+
+def native_token_ids(model: str) -> bool:
+    """Whether token id inputs for `model` are ids of its own tokenizer (`token_id_input = "native"`)."""
+    return get_model_options("embedding", model)["token_id_input"] == "native"
+
+
+# executor priority of the embedding lanes (`input_type`), lower runs first; rerank jobs run at 0 too
+LANE_PRIORITY = {"query": 0, "passage": 1}
+
+
+def record_lane_latency(lane: str, started: float):
+    """Observe a request's latency in its lane and count it against the lane's SLO."""
+    elapsed = time.perf_counter() - started
+    LANE_LATENCY.labels(lane=lane).observe(elapsed)
+    slo_ms = getattr(config.embedding.lanes, f"{lane}_slo_ms")
+    if slo_ms > 0 and elapsed * 1000 > slo_ms:
+        SLO_VIOLATIONS.labels(lane=lane).inc()
+
+
+async def native_vocab_size(model: str) -> Optional[int]:
+    """Size of the vocabulary bounding native token id inputs of `model`, None when ids go through tiktoken."""
+    if not native_token_ids(model):
+        return None
+    return len(await asyncio.to_thread(load_tokenizer, model))
+
+
 async def get_embedding(payload: Dict[str, Any]):
-    model_name = payload.get("model", config.embedding.default)
-    embed_model = embeddings_pool.load_embeddings(model=model_name)
-    embeddings = await embed_model.aembed_documents(payload["input"])
-    return {"embedding": embeddings, "token_num": len("".join(payload["input"])), "error_code": 0, "text": ""}
+    model_name = payload.get("model") or config.embedding.default
+    embed_model = await asyncio.to_thread(embeddings_pool.load_embeddings, model=model_name)
+    if isinstance(embed_model, (EmbeddingModel, ReplicatedModel)):
+        options = get_model_options("embedding", model_name)
+        output_dtype = payload.get("embedding_dtype", "float32")
+        outputs = await inference_executor.run(
+            embed_model.device,
+            embed_model.encode,
+            payload["input"],
+            batch_size=options["batch_size"],
+            max_length=options["max_length"],
+            normalize_to_unit=options["normalize"],
+            enable_tqdm=False,
+            query_instruction=payload.get("query_instruction", ""),
+            sort_by_length=options["sort_by_length"],
+            max_tokens_per_batch=options["max_tokens_per_batch"] or None,
+            return_token_nums=True,
+            pipeline=options["pipeline"],
+            dimensions=payload.get("dimensions"),
+            output_dtype=output_dtype,
+            concurrency=getattr(embed_model, "num_replicas", 1),
+            priority=LANE_PRIORITY[payload.get("lane", "passage")],
+        )
+        embeddings, token_nums = outputs[0], outputs[-1]
+        return {
+            "embedding": embeddings,
+            "scales": outputs[1] if output_dtype == "int8" else None,
+            "token_nums": token_nums,
+            "token_num": sum(token_nums),
+            "error_code": 0,
+            "text": "",
+        }
+
+    texts = payload["input"]
+    if texts and not isinstance(texts[0], str):
+        # native token ids, the langchain wrappers only take text
+        texts = embed_model.client.tokenizer.batch_decode(texts)
+    if payload.get("query_instruction"):
+        texts = [payload["query_instruction"] + text for text in texts]
+    embeddings = await inference_executor.run(
+        config.embedding.device,
+        embed_model.embed_documents,
+        texts,
+        priority=LANE_PRIORITY[payload.get("lane", "passage")],
+    )
+    # the langchain wrappers return float lists, truncate and cast on the host
+    embeddings, scales = cast_embeddings(
+        embeddings,
+        payload.get("embedding_dtype", "float32"),
+        dimensions=payload.get("dimensions"),
+        normalize=get_model_options("embedding", model_name)["normalize"],
+    )
+    # the langchain wrappers do not expose their tokenizer pass, count with the same tokenizer and truncation
+    token_nums = count_tokens(embed_model.client.tokenizer, texts, embed_model.client.max_seq_length)
+    return {
+        "embedding": embeddings,
+        "scales": scales,
+        "token_nums": token_nums,
+        "token_num": sum(token_nums),
+        "error_code": 0,
+        "text": "",
+    }
+
+
+embedding_scheduler = BatchScheduler(
+    get_embedding,
+    max_batch_size=config.embedding.batching.max_batch_size,
+    max_wait_ms=config.embedding.batching.max_wait_ms,
+    max_pending=config.embedding.batching.max_pending,
+    max_inflight=config.embedding.batching.max_inflight,
+)
+
+
+embedding_cache = EmbeddingCache(
+    max_items=config.embedding.cache.max_items,
+    disk_dir=config.embedding.cache.disk_dir or None,
+)
+
+
+async def embed_texts(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Embed `payload["input"]`, serving cached vectors first and running the model only for the misses.
+
+    The returned `embedding` is a matrix of `payload["embedding_dtype"]` (float32 by default) in input order,
+    `scales` its per-row scales for int8 (else None), `token_nums` the tokens consumed per input.
+    """
+    texts = payload["input"]
+    output_dtype = payload.get("embedding_dtype", "float32")
+    if config.embedding.cache.enable:
+        model_name = payload.get("model") or config.embedding.default
+        options = get_model_options("embedding", model_name)
+        # pooling the model is actually served with, None when it falls back to langchain
+        pooler = await asyncio.to_thread(resolve_pooler, model_name, options["pooler"])
+        namespace = embedding_cache.namespace(
+            model_name,
+            pooler or "sentence-transformers",
+            options["normalize"],
+            payload.get("query_instruction", ""),
+            dimensions=payload.get("dimensions"),
+            dtype=output_dtype,
+            backend=options["backend"],
+            max_length=options["max_length"],
+            use_fp16=options["use_fp16"],
+            quantize=options["quantize"],
+        )
+        # the disk tier reads and flushes memmapped files, keep that off the event loop
+        entries = await asyncio.to_thread(embedding_cache.get_many, namespace, texts)
+    else:
+        entries = [None] * len(texts)
+    vectors = [entry and entry[0] for entry in entries]
+    token_nums = [entry and entry[1] for entry in entries]
+
+    missing = [i for i, entry in enumerate(entries) if entry is None]
+    if missing:
+        miss_payload = {**payload, "input": [texts[i] for i in missing]}
+        if config.embedding.batching.enable:
+            # inputs from concurrent requests are merged into shared batches
+            embedding = await embedding_scheduler.submit(miss_payload)
+        else:
+            embedding = await get_embedding(miss_payload)
+        if "error_code" in embedding and embedding["error_code"] != 0:
+            return embedding
+        computed_f32 = np.asarray(embedding["embedding"], dtype=np.float32)
+        if embedding.get("scales") is not None:
+            computed_f32 = computed_f32 * embedding["scales"][:, None]
+        for i, vector, token_num in zip(missing, computed_f32, embedding["token_nums"]):
+            vectors[i] = vector
+            token_nums[i] = token_num
+        if config.embedding.cache.enable:
+            await asyncio.to_thread(
+                embedding_cache.put_many, namespace, miss_payload["input"], computed_f32, embedding["token_nums"]
+            )
+        if len(missing) == len(texts):
+            # nothing was cached: hand the model's output through without casting it again
+            return {
+                "embedding": np.asarray(embedding["embedding"]),
+                "scales": embedding.get("scales"),
+                "token_nums": token_nums,
+                "error_code": 0,
+                "text": "",
+            }
+
+    if not vectors:
+        computed, scales = np.empty((0, 0), dtype=np.float32), None
+    else:
+        # cached rows hold the values of the output dtype already, the cast is exact
+        computed, scales = cast_embeddings(np.stack(vectors), output_dtype)
+    return {
+        "embedding": computed,
+        "scales": scales,
+        "token_nums": token_nums,
+        "error_code": 0,
+        "text": "",
+    }
+
+
+def encode_embeddings(embeddings: np.ndarray, encoding_format: str) -> list:
+    """Render an embedding matrix for a JSON response."""
+    if encoding_format == "base64":
+        # little-endian, as returned by the OpenAI API for float32
+        buffer = np.ascontiguousarray(embeddings, dtype=embeddings.dtype.newbyteorder("<"))
+        return [base64.b64encode(row.tobytes()).decode("ascii") for row in buffer]
+    return embeddings.tolist()
+
+
+def binary_embeddings_response(embeddings: np.ndarray, token_num: int, scales: Optional[np.ndarray] = None) -> Response:
+    """Return the embedding matrix as one contiguous little-endian buffer of its dtype.
+
+    For int8 the float32 row scales follow the matrix, starting at byte `X-Embedding-Scales-Offset`.
+    """
+    buffer = np.ascontiguousarray(embeddings, dtype=embeddings.dtype.newbyteorder("<"))
+    headers = {
+        "X-Embedding-Shape": ",".join(str(dim) for dim in buffer.shape),
+        "X-Embedding-Dtype": str(embeddings.dtype),
+        "X-Prompt-Tokens": str(token_num),
+    }
+    content = buffer.tobytes()
+    if scales is not None:
+        headers["X-Embedding-Scales-Offset"] = str(len(content))
+        content += np.ascontiguousarray(scales, dtype="<f4").tobytes()
+    return Response(content=content, media_type="application/octet-stream", headers=headers)
 
 
-async def create_embeddings(request: EmbeddingsRequest, model_name: str = None) -> EmbeddingsResponse:
+def embedding_items(embedding: Dict[str, Any], encoding_format: str, offset: int = 0) -> List[Dict[str, Any]]:
+    """Response `data` items of an `embed_texts` result, int8 items with their `scale`."""
+    items = [
+        {"object": "embedding", "embedding": emb, "index": offset + i}
+        for i, emb in enumerate(encode_embeddings(embedding["embedding"], encoding_format))
+    ]
+    if embedding.get("scales") is not None:
+        for item, scale in zip(items, embedding["scales"].tolist()):
+            item["scale"] = scale
+    return items
+
+
+async def check_output_options(model: str, dimensions: Optional[int], embedding_dtype: Optional[str]) -> Optional[str]:
+    """Validation message for the output options of an embeddings request, None when they are valid."""
+    if dimensions is not None:
+        if dimensions <= 0:
+            return f"dimensions should be a positive integer, got {dimensions}"
+        try:
+            hidden_size = await asyncio.to_thread(embedding_dimension, model)
+        except (OSError, ValueError):
+            # unknown model, reported when it is loaded
+            hidden_size = None
+        if hidden_size is not None and dimensions > hidden_size:
+            return f"dimensions should be at most {hidden_size} for {model}, got {dimensions}"
+    if embedding_dtype is not None and embedding_dtype not in OUTPUT_DTYPES:
+        return f"embedding_dtype should be one of {', '.join(OUTPUT_DTYPES)}, got '{embedding_dtype}'"
+    return None
+
+
+def admit_request(tenant: str, items: int, tokens: int, check_size: bool = True) -> Optional[JSONResponse]:
+    """Error response when the tenant's request is too large (413) or over its rate (429), else None."""
+    try:
+        admission.admit(tenant, items, tokens, check_size=check_size)
+    except RequestTooLargeError as e:
+        return create_error_response(ErrorCode.PARAM_OUT_OF_RANGE, str(e), status_code=413)
+    except RateLimitedError as e:
+        response = create_error_response(ErrorCode.RATE_LIMIT, str(e), status_code=429)
+        response.headers["Retry-After"] = str(math.ceil(e.retry_after))
+        return response
+    return None
+
+
+async def create_embeddings(
+    request: EmbeddingsRequest,
+    model_name: str = None,
+    api_key: Optional[str] = Depends(check_api_key),
+) -> EmbeddingsResponse:
     """Creates embeddings for the text"""
-    request.input = process_input(request.model, request.input)
-    data = []
+    encoding_format = request.encoding_format or "float"
+    if encoding_format not in ("float", "base64", "binary"):
+        return create_error_response(
+            ErrorCode.PARAM_OUT_OF_RANGE,
+            f"encoding_format should be one of 'float', 'base64', 'binary', got '{encoding_format}'",
+        )
+    model = request.model or config.embedding.default
+    if message := await check_output_options(model, request.dimensions, request.embedding_dtype):
+        return create_error_response(ErrorCode.PARAM_OUT_OF_RANGE, message)
+    lane = request.input_type or "passage"
+    if lane not in LANE_PRIORITY:
+        return create_error_response(
+            ErrorCode.PARAM_OUT_OF_RANGE,
+            f"input_type should be one of {', '.join(LANE_PRIORITY)}, got '{request.input_type}'",
+        )
+    started = time.perf_counter()
+    try:
+        request.input = process_input(
+            model,
+            request.input,
+            native_token_ids=native_token_ids(model),
+            vocab_size=await native_vocab_size(model),
+        )
+    except ValueError as e:
+        return create_error_response(ErrorCode.PARAM_OUT_OF_RANGE, str(e))
+    tenant = api_key or ANONYMOUS
+    options = get_model_options("embedding", model)
+    reserved = estimate_tokens(request.input, options["max_length"])
+    if rejection := admit_request(tenant, len(request.input), reserved):
+        return rejection
+    payload = {
+        "model": request.model,
+        "input": request.input,
+        "tenant": tenant,
+        # query and passage inputs never share a batch, query batches stay small and run first
+        "lane": lane,
+    }
+    if lane == "query" and options["query_instruction"]:
+        payload["query_instruction"] = options["query_instruction"]
+    # only set options join the batch key, so default requests keep sharing batches
+    if request.dimensions is not None:
+        payload["dimensions"] = request.dimensions
+    if request.embedding_dtype not in (None, "float32"):
+        payload["embedding_dtype"] = request.embedding_dtype
     token_num = 0
-    batch_size = 32
-    batches = [
-        request.input[i : min(i + batch_size, len(request.input))] for i in range(0, len(request.input), batch_size)
-    ]
-    for num_batch, batch in enumerate(batches):
-        payload = {
-            "model": request.model,
-            "input": batch,
-            "encoding_format": request.encoding_format,
-        }
-        embedding = await get_embedding(payload)
+    try:
+        embedding = await embed_texts(payload)
         if "error_code" in embedding and embedding["error_code"] != 0:
             return create_error_response(embedding["error_code"], embedding["text"])
-        data += [
-            {
-                "object": "embedding",
-                "embedding": emb,
-                "index": num_batch * batch_size + i,
-            }
-            for i, emb in enumerate(embedding["embedding"])
-        ]
-        token_num += embedding["token_num"]
-    return EmbeddingsResponse(
-        data=data,
-        model=request.model,
+        token_num = sum(embedding["token_nums"])
+    except RequestTooLargeError as e:
+        return create_error_response(ErrorCode.PARAM_OUT_OF_RANGE, str(e), status_code=413)
+    except EngineOverloadedError as e:
+        return create_error_response(ErrorCode.ENGINE_OVERLOADED, str(e), status_code=429)
+    finally:
+        admission.settle(tenant, reserved, token_num)
+    REQUESTS.labels(endpoint="embeddings", model=model).inc()
+    TOKENS.labels(endpoint="embeddings", model=model).inc(token_num)
+    with timed(SERIALIZE_TIME, format=encoding_format):
+        if encoding_format == "binary":
+            response = binary_embeddings_response(embedding["embedding"], token_num, embedding.get("scales"))
+        else:
+            # rendered here, so FastAPI neither re-validates it against the response model nor encodes it
+            # outside the timer
+            response = JSONResponse(
+                EmbeddingsResponse(
+                    data=embedding_items(embedding, encoding_format),
+                    model=model,
+                    usage=UsageInfo(
+                        prompt_tokens=token_num,
+                        total_tokens=token_num,
+                        completion_tokens=None,
+                    ),
+                ).dict(exclude_none=True)
+            )
+    record_lane_latency(lane, started)
+    return response
+
+
+async def read_stream_inputs(request: Request) -> List[Any]:
+    """Items of an NDJSON body, parsed line by line as it arrives, or of a JSON array body."""
+    if request.headers.get("content-type", "").startswith("application/json"):
+        body = await request.json()
+        return body if isinstance(body, list) else body.get("input", [])
+    items, buffer = [], b""
+    async for chunk in request.stream():
+        *lines, buffer = (buffer + chunk).split(b"\n")
+        items.extend(json.loads(line) for line in lines if line.strip())
+    if buffer.strip():
+        items.append(json.loads(buffer))
+    return items
+
+
+async def stream_embeddings(
+    request: Request,
+    model: Optional[str] = None,
+    encoding_format: str = "float",
+    dimensions: Optional[int] = None,
+    embedding_dtype: Optional[str] = None,
+    api_key: Optional[str] = Depends(check_api_key),
+):
+    """Embed a bulk NDJSON / JSON array body and stream one NDJSON line per input back.
+
+    Inputs are strings or `{"id": ..., "text": ...}` objects; any other line, such as a bare number that
+    would pass for a token id, rejects the whole body with 400. They are embedded in batches of
+    `embedding.stream.batch_size` with at most `embedding.stream.max_inflight` batches in flight, and each
+    batch is written out as soon as it is ready, so the server never holds more than those batches'
+    vectors. The input texts themselves are read completely first: the response stream shares the ASGI
+    receive channel, which it listens on for disconnects. A final `{"object": "usage", ...}` line carries
+    the token count, or an `error` line ends the stream early. The stream counts as one request of the API
+    key and is not subject to the per-request size limits; each batch waits for its tokens instead.
+    """
+    if encoding_format not in ("float", "base64"):
+        return create_error_response(
+            ErrorCode.PARAM_OUT_OF_RANGE,
+            f"encoding_format should be one of 'float', 'base64', got '{encoding_format}'",
+        )
+    model = model or config.embedding.default
+    if message := await check_output_options(model, dimensions, embedding_dtype):
+        return create_error_response(ErrorCode.PARAM_OUT_OF_RANGE, message)
+    options = {}
+    if dimensions is not None:
+        options["dimensions"] = dimensions
+    if embedding_dtype not in (None, "float32"):
+        options["embedding_dtype"] = embedding_dtype
+    try:
+        items = await read_stream_inputs(request)
+    except (json.JSONDecodeError, AttributeError) as e:
+        return create_error_response(ErrorCode.VALIDATION_TYPE_ERROR, f"invalid NDJSON / JSON array body: {e}")
+    for index, item in enumerate(items):
+        if not isinstance(item.get("text") if isinstance(item, dict) else item, str):
+            return create_error_response(
+                ErrorCode.VALIDATION_TYPE_ERROR,
+                f'input {index} should be a string or an object with a string "text", got {json.dumps(item)[:100]}',
+            )
+    tenant = api_key or ANONYMOUS
+    if rejection := admit_request(tenant, len(items), 0, check_size=False):
+        return rejection
+    max_length = get_model_options("embedding", model)["max_length"]
+
+    async def embed_batch(texts: List[Any]) -> Dict[str, Any]:
+        reserved = estimate_tokens(texts, max_length)
+        await admission.wait_tokens(tenant, reserved)
+        embedding = {}
+        try:
+            payload = {"model": model, "input": texts, "tenant": tenant, "lane": "passage", **options}
+            embedding = await embed_texts(payload)
+        finally:
+            admission.settle(tenant, reserved, sum(embedding.get("token_nums") or []))
+        return embedding
+
+    def start_batch(offset: int) -> asyncio.Task:
+        batch = items[offset : offset + config.embedding.stream.batch_size]
+        texts = [item["text"] if isinstance(item, dict) else item for item in batch]
+        return asyncio.create_task(embed_batch(texts))
+
+    counts = {"tokens": 0}
+
+    async def render(offset: int, task: asyncio.Task) -> bytes:
+        embedding = await task
+        if embedding.get("error_code", 0) != 0:
+            raise RuntimeError(embedding["text"])
+        counts["tokens"] += sum(embedding["token_nums"])
+        with timed(SERIALIZE_TIME, format=f"stream-{encoding_format}"):
+            lines = []
+            for line, token_num in zip(embedding_items(embedding, encoding_format, offset), embedding["token_nums"]):
+                line["tokens"] = token_num
+                if isinstance(items[line["index"]], dict) and "id" in items[line["index"]]:
+                    line["id"] = items[line["index"]]["id"]
+                lines.append(json.dumps(line, ensure_ascii=False))
+            return ("\n".join(lines) + "\n").encode()
+
+    async def generate() -> AsyncIterator[bytes]:
+        pending = deque()
+        try:
+            for offset in range(0, len(items), config.embedding.stream.batch_size):
+                pending.append((offset, start_batch(offset)))
+                if len(pending) >= config.embedding.stream.max_inflight:
+                    yield await render(*pending.popleft())
+            while pending:
+                yield await render(*pending.popleft())
+        except Exception as e:
+            logger.exception(f"流式向量化中断：{e}")
+            yield (json.dumps({"object": "error", "message": str(e)}, ensure_ascii=False) + "\n").encode()
+            return
+        finally:
+            # also reached when the client disconnects mid-stream
+            for _, task in pending:
+                task.cancel()
+        REQUESTS.labels(endpoint="embeddings_stream", model=model).inc()
+        TOKENS.labels(endpoint="embeddings_stream", model=model).inc(counts["tokens"])
+        usage = {"object": "usage", "count": len(items), "prompt_tokens": counts["tokens"], "total_tokens": counts["tokens"]}
+        yield (json.dumps(usage) + "\n").encode()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+async def get_cache_stats():
+    return embedding_cache.stats()
+
+
+async def count_input_tokens(request: TokenCountRequest) -> TokenCountResponse:
+    """Count tokens per input with the model's tokenizer, without running the model"""
+    model = request.model or config.embedding.default
+    # the first use of a model downloads its tokenizer
+    tokenizer = await asyncio.to_thread(load_tokenizer, model)
+    try:
+        texts = process_input(model, request.input, native_token_ids=native_token_ids(model), vocab_size=len(tokenizer))
+    except ValueError as e:
+        return create_error_response(ErrorCode.PARAM_OUT_OF_RANGE, str(e))
+    if texts and not isinstance(texts[0], str):
+        token_nums = [len(ids) + tokenizer.num_special_tokens_to_add(pair=False) for ids in texts]
+    else:
+        token_nums = await asyncio.to_thread(count_tokens, tokenizer, texts)
+    max_length = get_model_options("embedding", model)["max_length"]
+    return TokenCountResponse(
+        model=model,
+        data=[TokenCountItem(index=i, tokens=n, truncated=n > max_length) for i, n in enumerate(token_nums)],
+        total_tokens=sum(min(n, max_length) for n in token_nums),
+        max_length=max_length,
+    )
+
+
+async def create_rerank(request: RerankRequest, api_key: Optional[str] = Depends(check_api_key)) -> RerankResponse:
+    """Ranks the documents by relevance to the query"""
+    if request.top_n is not None and request.top_n < 1:
+        return create_error_response(
+            ErrorCode.PARAM_OUT_OF_RANGE, f"top_n should be a positive integer, got {request.top_n}"
+        )
+    model_name = request.model or config.reranker.default
+    options = get_model_options("reranker", model_name)
+    tenant = api_key or ANONYMOUS
+    # long documents are split into windows that each repeat the query, do not cap at `max_length`
+    reserved = sum(len(request.query) + len(document) + 3 for document in request.documents)
+    if rejection := admit_request(tenant, len(request.documents), reserved):
+        return rejection
+    result = {"token_num": 0}
+    try:
+        reranker = await asyncio.to_thread(embeddings_pool.load_reranker, model=model_name)
+        result = await inference_executor.run(
+            reranker.device,
+            reranker.rerank,
+            request.query,
+            request.documents,
+            batch_size=options["batch_size"],
+            max_length=options["max_length"],
+            overlap_tokens=options["overlap_tokens"],
+            max_tokens_per_batch=options["max_tokens_per_batch"] or None,
+            top_n=request.top_n,
+            concurrency=getattr(reranker, "num_replicas", 1),
+        )
+    except EngineOverloadedError as e:
+        return create_error_response(ErrorCode.ENGINE_OVERLOADED, str(e), status_code=429)
+    finally:
+        admission.settle(tenant, reserved, result["token_num"])
+    REQUESTS.labels(endpoint="rerank", model=model_name).inc()
+    TOKENS.labels(endpoint="rerank", model=model_name).inc(result["token_num"])
+    return RerankResponse(
+        model=model_name,
+        results=[
+            RerankResult(
+                index=index,
+                relevance_score=score,
+                document=request.documents[index] if request.return_documents else None,
+            )
+            for index, score in zip(result["rerank_ids"], result["rerank_scores"])
+        ],
         usage=UsageInfo(
-            prompt_tokens=token_num,
-            total_tokens=token_num,
+            prompt_tokens=result["token_num"],
+            total_tokens=result["token_num"],
             completion_tokens=None,
         ),
     ).dict(exclude_none=True)
+
+
+async def get_pool_stats():
+    return embeddings_pool.stats()
+
+
+async def get_metrics():
+    """Prometheus text exposition"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+async def health_live():
+    return {"status": "alive"}
+
+
+async def health_ready():
+    """200 once every preloaded model is warm, 503 before that"""
+    return JSONResponse(readiness.report(), status_code=200 if readiness.ready else 503)
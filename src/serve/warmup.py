@@ -0,0 +1,117 @@
+import threading
+import time
+from typing import Any, Dict, List
+
+from configs import config, get_model_options
+
+from ..models import EmbeddingModel, ReplicatedModel
+from ..utils.Logger import logger
+from .model_worker import embeddings_pool
+
+
+class Readiness:
+    """Preload progress of the configured models, reported by the readiness endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.models: Dict[str, str] = {}
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def ready(self) -> bool:
+        return self.finished_at is not None and all(state == "ready" for state in self.models.values())
+
+    def update(self, name: str, state: str):
+        with self._lock:
+            self.models[name] = state
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "status": "ready" if self.ready else "starting" if self.finished_at is None else "failed",
+            "models": dict(self.models),
+            "warmup_seconds": self.finished_at - self.started_at if self.finished_at else None,
+        }
+
+
+readiness = Readiness()
+
+
+def synthetic_texts(tokenizer, length: int, count: int) -> List[str]:
+    """Texts of roughly `length` tokens for warmup batches."""
+    word = "warmup"
+    per_word = max(len(tokenizer(word, add_special_tokens=False)["input_ids"]), 1)
+    return [" ".join([word] * max(length // per_word, 1))] * count
+
+
+def warmup_embedding(model: str):
+    options = get_model_options("embedding", model)
+    embed_model = embeddings_pool.load_embeddings(model=model)
+    if isinstance(embed_model, (EmbeddingModel, ReplicatedModel)):
+        tokenizer = embed_model.tokenizer
+    else:
+        tokenizer = embed_model.client.tokenizer
+    for length in config.startup.warmup_lengths:
+        texts = synthetic_texts(tokenizer, min(length, options["max_length"]), config.startup.warmup_batch_size)
+        encode_kwargs = dict(
+            batch_size=options["batch_size"],
+            max_length=options["max_length"],
+            enable_tqdm=False,
+            sort_by_length=options["sort_by_length"],
+            max_tokens_per_batch=options["max_tokens_per_batch"] or None,
+            pipeline=options["pipeline"],
+        )
+        if isinstance(embed_model, ReplicatedModel):
+            # a warmup batch fits one chunk, which would only ever reach the least loaded replica
+            embed_model.broadcast("encode", texts, **encode_kwargs)
+        elif isinstance(embed_model, EmbeddingModel):
+            embed_model.encode(texts, **encode_kwargs)
+        else:
+            embed_model.embed_documents(texts)
+
+
+def warmup_reranker(model: str):
+    options = get_model_options("reranker", model)
+    reranker = embeddings_pool.load_reranker(model=model)
+    for length in config.startup.warmup_lengths:
+        passages = synthetic_texts(reranker.tokenizer, min(length, options["max_length"]), config.startup.warmup_batch_size)
+        rerank_kwargs = dict(
+            batch_size=options["batch_size"],
+            max_length=options["max_length"],
+            overlap_tokens=options["overlap_tokens"],
+            max_tokens_per_batch=options["max_tokens_per_batch"] or None,
+        )
+        if isinstance(reranker, ReplicatedModel):
+            reranker.broadcast("rerank", "warmup", passages, **rerank_kwargs)
+        else:
+            reranker.rerank("warmup", passages, **rerank_kwargs)
+
+
+def preload_models():
+    """Load and warm up every model listed in `[startup]`, recording progress in `readiness`."""
+    readiness.started_at = time.time()
+    jobs = [(f"embedding:{m}", warmup_embedding, m) for m in config.startup.embedding_models]
+    jobs += [(f"reranker:{m}", warmup_reranker, m) for m in config.startup.reranker_models]
+    for name, _, _ in jobs:
+        readiness.update(name, "pending")
+
+    for name, warmup, model in jobs:
+        readiness.update(name, "loading")
+        start = time.time()
+        try:
+            warmup(model)
+        except Exception as e:
+            logger.exception(f"预加载 {name} 失败：{e}")
+            readiness.update(name, f"failed: {e}")
+        else:
+            logger.info(f"预加载 {name} 完成，耗时 {time.time() - start:.1f}s")
+            readiness.update(name, "ready")
+    readiness.finished_at = time.time()
+
+
+def start_preloading():
+    """Preload in the background, so health checks are answered while the models warm up."""
+    if not config.startup.preload:
+        readiness.started_at = readiness.finished_at = time.time()
+        return
+    threading.Thread(target=preload_models, name="model-preload", daemon=True).start()
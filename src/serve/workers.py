@@ -0,0 +1,96 @@
+import multiprocessing
+import os
+import signal
+import socket
+from typing import Callable, List, Optional
+
+import uvicorn
+from fastapi import FastAPI
+
+from configs import config
+
+from ..utils.Logger import logger
+from .model_worker import embeddings_pool
+
+
+def split_cpus(num_workers: int) -> List[List[int]]:
+    """Partition the cores this process may run on into `num_workers` contiguous sets."""
+    cpus = sorted(os.sched_getaffinity(0))
+    per_worker = max(len(cpus) // num_workers, 1)
+    return [cpus[i * per_worker : (i + 1) * per_worker] or cpus for i in range(num_workers)]
+
+
+def worker_device(index: int) -> Optional[str]:
+    devices = config.server.worker_devices
+    return devices[index % len(devices)] if devices else None
+
+
+def preload_shared_weights():
+    """Load the CPU models in the parent so forked workers share their weights copy-on-write.
+
+    Only loading happens here: warmup runs in the workers, since OpenMP thread pools do not survive fork.
+    """
+    import torch
+
+    threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    try:
+        if config.embedding.device == "cpu":
+            for model in config.startup.embedding_models:
+                embeddings_pool.load_embeddings(model=model)
+        if config.reranker.device == "cpu":
+            for model in config.startup.reranker_models:
+                embeddings_pool.load_reranker(model=model)
+    finally:
+        torch.set_num_threads(threads)
+    logger.info(f"主进程已加载共享模型：{embeddings_pool.keys()}")
+
+
+def _run_worker(index: int, app_factory: Callable[[], FastAPI], sock: socket.socket, cpus: Optional[List[int]]):
+    if cpus:
+        import torch
+
+        os.sched_setaffinity(0, cpus)
+        torch.set_num_threads(len(cpus))
+    if device := worker_device(index):
+        config.embedding.device = device
+        config.reranker.device = device
+    logger.info(f"worker {index} (pid {os.getpid()}) 启动，device: {config.embedding.device}，cpus: {cpus or 'all'}")
+
+    server = uvicorn.Server(uvicorn.Config(app_factory(), log_level="info"))
+    server.run(sockets=[sock])
+
+
+def serve_workers(app_factory: Callable[[], FastAPI], host: str, port: int, num_workers: int):
+    """Serve `app_factory()` from `num_workers` forked processes accepting on one shared socket."""
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        logger.warning("未设置 PROMETHEUS_MULTIPROC_DIR，多 worker 时 /metrics 只返回处理该次抓取的 worker 的指标")
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    if config.server.share_weights:
+        preload_shared_weights()
+
+    cpu_sets = split_cpus(num_workers) if config.server.pin_cpus else [None] * num_workers
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=_run_worker, args=(i, app_factory, sock, cpu_sets[i]), name=f"kengine-worker-{i}")
+        for i in range(num_workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"{num_workers} 个 worker 监听 {host}:{port}")
+
+    def stop(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for process in processes:
+        process.join()
+    sock.close()
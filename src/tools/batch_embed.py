@@ -0,0 +1,215 @@
+"""Embed a corpus file offline into a memory-mapped `.npy` matrix plus an id index, resumably.
+
+Usage:
+python -m src.tools.batch_embed corpus.jsonl --output out/ --model maidalun1020/bce-embedding-base_v1 --dtype float16
+python -m src.tools.batch_embed corpus.parquet --output out/ --text-field content --id-field doc_id
+
+Writes `out/embeddings.npy` (rows in input order), `out/ids.jsonl` (one id per row) and `out/checkpoint.json`.
+Re-running the same command after an interruption continues after the last checkpointed chunk.
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator, List, Tuple
+
+import numpy as np
+
+sys.path.append(Path(__file__).parents[2].as_posix())
+from src.models import EmbeddingModel
+from src.utils import logger
+
+CHECKPOINT_FIELDS = ("input", "model", "pooler", "normalize", "max_length", "query_instruction", "dimensions", "dtype", "rows")
+
+
+def iter_records(path: Path, text_field: str, id_field: str, skip: int = 0) -> Iterator[Tuple[Any, str]]:
+    """Yield `(id, text)` from a Parquet, JSONL or plain text file, streaming; ids default to the row number."""
+    row = 0
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(path)
+        columns = [text_field] + ([id_field] if id_field in parquet.schema_arrow.names else [])
+        for batch in parquet.iter_batches(columns=columns):
+            texts = batch.column(text_field).to_pylist()
+            ids = batch.column(id_field).to_pylist() if len(columns) > 1 else range(row, row + len(texts))
+            for record_id, text in zip(ids, texts):
+                if row >= skip:
+                    yield record_id, text
+                row += 1
+        return
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if row >= skip:
+                if path.suffix in (".jsonl", ".json"):
+                    record = json.loads(line)
+                    yield record.get(id_field, row), record[text_field]
+                else:
+                    yield row, line.rstrip("\n")
+            row += 1
+
+
+def count_records(path: Path) -> int:
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        return pq.ParquetFile(path).metadata.num_rows
+    with open(path, encoding="utf-8") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def prefetch_chunks(records: Iterator[Tuple[Any, str]], chunk_size: int, depth: int = 2) -> Iterator[List[Tuple[Any, str]]]:
+    """Read and parse the next chunks on a background thread while the current one is being embedded."""
+    chunks = queue.Queue(maxsize=depth)
+
+    def reader():
+        try:
+            chunk = []
+            for record in records:
+                chunk.append(record)
+                if len(chunk) == chunk_size:
+                    chunks.put(chunk)
+                    chunk = []
+            if chunk:
+                chunks.put(chunk)
+        except Exception as e:
+            chunks.put(e)
+        chunks.put(None)
+
+    threading.Thread(target=reader, name="batch-embed-reader", daemon=True).start()
+    while (chunk := chunks.get()) is not None:
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+
+def load_checkpoint(output: Path, expected: dict) -> int:
+    """Rows already done in `output`, 0 for a fresh run; refuses to resume a different job."""
+    checkpoint_path = output / "checkpoint.json"
+    if not checkpoint_path.exists():
+        return 0
+    checkpoint = json.loads(checkpoint_path.read_text())
+    mismatched = [k for k in CHECKPOINT_FIELDS if checkpoint.get(k) != expected[k]]
+    if mismatched:
+        raise SystemExit(f"{output} holds a different job (differs in {mismatched}), pass --overwrite to restart it")
+    return checkpoint["rows_done"]
+
+
+def save_checkpoint(output: Path, job: dict, rows_done: int):
+    tmp = output / "checkpoint.json.tmp"
+    tmp.write_text(json.dumps({**job, "rows_done": rows_done, "updated_at": time.time()}, indent=4))
+    os.replace(tmp, output / "checkpoint.json")
+
+
+def truncate_ids(path: Path, rows: int):
+    """Drop id lines written after the last checkpoint."""
+    if not path.exists():
+        return
+    with open(path, "rb+") as f:
+        for _ in range(rows):
+            f.readline()
+        f.truncate()
+
+
+def run(args):
+    input_path, output = Path(args.input), Path(args.output)
+    output.mkdir(parents=True, exist_ok=True)
+    if args.overwrite:
+        for name in ("checkpoint.json", "embeddings.npy", "ids.jsonl"):
+            (output / name).unlink(missing_ok=True)
+
+    model = EmbeddingModel(
+        args.model,
+        pooler=args.pooler,
+        use_fp16=args.use_fp16,
+        device=args.device,
+        quantize=args.quantize or None,
+    )
+    encode_kwargs = dict(
+        batch_size=args.batch_size,
+        max_length=args.max_length,
+        normalize_to_unit=not args.no_normalize,
+        enable_tqdm=False,
+        query_instruction=args.query_instruction,
+        sort_by_length=True,
+        max_tokens_per_batch=args.max_tokens_per_batch or None,
+        pipeline=True,
+        dimensions=args.dimensions,
+        output_dtype=args.dtype,
+    )
+    job = {
+        "input": input_path.resolve().as_posix(),
+        "model": args.model,
+        "pooler": args.pooler,
+        "normalize": not args.no_normalize,
+        "max_length": args.max_length,
+        "query_instruction": args.query_instruction,
+        "dimensions": args.dimensions,
+        "dtype": args.dtype,
+        "rows": count_records(input_path),
+    }
+    rows_done = load_checkpoint(output, job)
+    dim = model.encode(["dimension probe"], **encode_kwargs).shape[1]
+
+    matrix_path = output / "embeddings.npy"
+    if rows_done:
+        if not matrix_path.exists():
+            raise SystemExit(f"{matrix_path} is missing, pass --overwrite to restart the job")
+        matrix = np.load(matrix_path, mmap_mode="r+")
+    else:
+        matrix = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=args.dtype, shape=(job["rows"], dim))
+    truncate_ids(output / "ids.jsonl", rows_done)
+    logger.info(f"Embedding {job['rows']} rows of {input_path} into {output}, resuming at row {rows_done}")
+
+    start, tokens, resumed_at = time.perf_counter(), 0, rows_done
+    records = iter_records(input_path, args.text_field, args.id_field, skip=rows_done)
+    with open(output / "ids.jsonl", "a", encoding="utf-8") as ids_file:
+        for chunk in prefetch_chunks(records, args.chunk_size):
+            embeddings, token_nums = model.encode([text for _, text in chunk], return_token_nums=True, **encode_kwargs)
+            matrix[rows_done : rows_done + len(chunk)] = embeddings
+            matrix.flush()
+            ids_file.writelines(json.dumps(record_id, ensure_ascii=False) + "\n" for record_id, _ in chunk)
+            ids_file.flush()
+            os.fsync(ids_file.fileno())
+            rows_done += len(chunk)
+            tokens += sum(token_nums)
+            save_checkpoint(output, job, rows_done)
+
+            seconds = time.perf_counter() - start
+            eta = (job["rows"] - rows_done) * seconds / (rows_done - resumed_at)
+            logger.info(f"{rows_done}/{job['rows']} rows, {tokens / seconds:.0f} tokens/s, eta {eta:.0f}s")
+    logger.info(f"Done: {output / 'embeddings.npy'} {matrix.shape} {args.dtype}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline, resumable batch embedding of a corpus file")
+    parser.add_argument("input", type=str, help=".jsonl, .parquet or a text file with one sample per line")
+    parser.add_argument("--output", required=True, type=str, help="output directory")
+    parser.add_argument("--model", type=str, default="maidalun1020/bce-embedding-base_v1", help="model name or path")
+    parser.add_argument("--device", type=str, default=None, help="cpu, cuda or cuda:N, defaults to cuda when available")
+    parser.add_argument("--pooler", type=str, default="cls", choices=["cls", "mean"])
+    parser.add_argument("--use-fp16", action="store_true")
+    parser.add_argument("--quantize", type=str, default="", help="int8 for dynamic INT8 quantization on CPU")
+    parser.add_argument("--no-normalize", action="store_true", help="keep raw pooled vectors")
+    parser.add_argument("--query-instruction", type=str, default="")
+    parser.add_argument("--dtype", type=str, default="float32", choices=["float32", "float16"], help="cast on the device")
+    parser.add_argument("--dimensions", type=int, default=None, help="keep the first N components, re-normalized")
+    parser.add_argument("--batch-size", type=int, default=64, help="rows per forward pass")
+    parser.add_argument("--max-tokens-per-batch", type=int, default=16384, help="0 to batch by --batch-size only")
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--chunk-size", type=int, default=4096, help="rows per checkpoint")
+    parser.add_argument("--text-field", type=str, default="text")
+    parser.add_argument("--id-field", type=str, default="id")
+    parser.add_argument("--overwrite", action="store_true", help="discard an existing checkpoint in --output")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run(parse_args())
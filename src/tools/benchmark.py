@@ -0,0 +1,189 @@
+"""Load generator for the embedding path: latency percentiles, texts/s and tokens/s.
+
+Usage:
+python -m src.tools.benchmark http --url http://127.0.0.1:8080 --concurrency 16 --lengths uniform:16-256
+python -m src.tools.benchmark local --model sentence-transformers/all-MiniLM-L6-v2 --batch-size 32 --lengths lognormal:128
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+sys.path.append(Path(__file__).parents[2].as_posix())
+
+DEFAULT_LOCAL_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+VOCABULARY = (
+    "the of and to in is for that on with as by this are from be at an or it which was retrieval embedding "
+    "vector model query passage document index search rerank latency throughput batch token 向量 检索 文档 "
+    "模型 推理 查询 排序 相关 知识 服务"
+).split()
+
+
+def sample_lengths(spec: str, count: int, rng: random.Random) -> List[int]:
+    """Input lengths in words: `fixed:N`, `uniform:A-B` or `lognormal:MEDIAN[,SIGMA]`."""
+    kind, _, value = spec.partition(":")
+    if kind == "fixed":
+        return [int(value)] * count
+    if kind == "uniform":
+        low, high = (int(v) for v in value.split("-"))
+        return [rng.randint(low, high) for _ in range(count)]
+    if kind == "lognormal":
+        median, _, sigma = value.partition(",")
+        return [max(1, int(rng.lognormvariate(np.log(float(median)), float(sigma or 0.8)))) for _ in range(count)]
+    raise ValueError(f"length spec should be fixed:N, uniform:A-B or lognormal:MEDIAN[,SIGMA], got '{spec}'")
+
+
+def make_requests(args, rng: random.Random) -> List[List[str]]:
+    """`args.requests` inputs of `args.batch_size` texts each, from `--corpus` or synthetic words."""
+    total = args.requests * args.batch_size
+    if args.corpus:
+        corpus = [line.strip() for line in open(args.corpus, encoding="utf-8") if line.strip()]
+        texts = [corpus[i % len(corpus)] for i in range(total)]
+    else:
+        texts = [" ".join(rng.choices(VOCABULARY, k=n)) for n in sample_lengths(args.lengths, total, rng)]
+    return [texts[i : i + args.batch_size] for i in range(0, total, args.batch_size)]
+
+
+def report(latencies: List[float], texts: int, tokens: int, seconds: float, errors: int) -> Dict[str, float]:
+    latencies_ms = np.asarray(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "texts": texts,
+        "tokens": tokens,
+        "seconds": seconds,
+        "latency_p50_ms": float(np.percentile(latencies_ms, 50)),
+        "latency_p95_ms": float(np.percentile(latencies_ms, 95)),
+        "latency_p99_ms": float(np.percentile(latencies_ms, 99)),
+        "latency_max_ms": float(latencies_ms.max()),
+        "texts_per_second": texts / seconds if seconds else 0.0,
+        "tokens_per_second": tokens / seconds if seconds else 0.0,
+    }
+
+
+async def run_http(args, batches: List[List[str]]) -> Dict[str, float]:
+    """Drive `/v1/embeddings` with `args.concurrency` clients sharing one connection pool."""
+    import aiohttp
+
+    headers = {"Authorization": f"Bearer {args.api_key}"} if args.api_key else {}
+    url = args.url.rstrip("/") + "/v1/embeddings"
+    latencies, counts = [], {"texts": 0, "tokens": 0, "errors": 0}
+    queue = asyncio.Queue()
+    for batch in batches:
+        queue.put_nowait(batch)
+
+    async def post(session: aiohttp.ClientSession, batch: List[str]) -> Tuple[int, dict]:
+        payload = {"input": batch, "encoding_format": args.encoding_format}
+        if args.model:
+            # unset: benchmark the server's default model instead of making it load another one
+            payload["model"] = args.model
+        async with session.post(url, json=payload, headers=headers) as response:
+            if args.encoding_format == "binary":
+                await response.read()
+                return response.status, {"usage": {"prompt_tokens": int(response.headers.get("X-Prompt-Tokens", 0))}}
+            return response.status, await response.json()
+
+    async def client(session: aiohttp.ClientSession):
+        while not queue.empty():
+            batch = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                status, body = await post(session, batch)
+            except aiohttp.ClientError:
+                status, body = 0, {}
+            if status != 200:
+                counts["errors"] += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            counts["texts"] += len(batch)
+            counts["tokens"] += body.get("usage", {}).get("prompt_tokens", 0)
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=600)) as session:
+        for batch in batches[: args.warmup]:
+            await post(session, batch)
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(args.concurrency)))
+        seconds = time.perf_counter() - start
+    return report(latencies, counts["texts"], counts["tokens"], seconds, counts["errors"])
+
+
+def run_local(args, batches: List[List[str]]) -> Dict[str, float]:
+    """Call `EmbeddingModel.encode` in-process from `args.concurrency` threads."""
+    from src.models import EmbeddingModel
+
+    model = EmbeddingModel(args.model, device=args.device, quantize=args.quantize or None)
+    encode: Callable = lambda batch: model.encode(
+        batch,
+        batch_size=args.batch_size,
+        max_length=args.max_length,
+        enable_tqdm=False,
+        sort_by_length=True,
+        return_token_nums=True,
+    )
+    for batch in batches[: args.warmup]:
+        encode(batch)
+
+    lock = threading.Lock()
+    latencies, counts = [], {"texts": 0, "tokens": 0}
+
+    def timed_encode(batch: List[str]):
+        start = time.perf_counter()
+        _, token_nums = encode(batch)
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            counts["texts"] += len(batch)
+            counts["tokens"] += sum(token_nums)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(timed_encode, batches))
+    return report(latencies, counts["texts"], counts["tokens"], time.perf_counter() - start, 0)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="KEngine embedding benchmark")
+    parser.add_argument("target", choices=["http", "local"], help="a running server or EmbeddingModel.encode in-process")
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8080")
+    parser.add_argument("--api-key", type=str, default="")
+    parser.add_argument(
+        "--model",
+        type=str,
+        default=None,
+        help=f"model name or path; the server's default for http, {DEFAULT_LOCAL_MODEL} for local",
+    )
+    parser.add_argument("--device", type=str, default="cpu", help="local target only")
+    parser.add_argument("--quantize", type=str, default="", help="local target only, e.g. int8")
+    parser.add_argument("--encoding-format", type=str, default="float", choices=["float", "base64", "binary"])
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=16, help="texts per request")
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--lengths", type=str, default="uniform:16-256", help="fixed:N | uniform:A-B | lognormal:MEDIAN[,SIGMA]")
+    parser.add_argument("--corpus", type=str, default=None, help="text file with one sample per line, instead of synthetic texts")
+    parser.add_argument("--warmup", type=int, default=5, help="requests sent before measuring")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.target == "local" and args.model is None:
+        args.model = DEFAULT_LOCAL_MODEL
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    batches = make_requests(args, random.Random(args.seed))
+    if args.target == "http":
+        result = asyncio.run(run_http(args, batches))
+    else:
+        result = run_local(args, batches)
+    config = {k: v for k, v in vars(args).items() if k != "api_key"}
+    print(json.dumps({**config, **result}, indent=4, ensure_ascii=False))
@@ -0,0 +1,79 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Tuple
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+    from prometheus_client import multiprocess
+except ImportError:  # metrics are optional, everything below turns into no-ops
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+    Counter = Histogram = None
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+RATIO_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs) -> "_NoopMetric":
+        return self
+
+    def observe(self, value: float):
+        pass
+
+    def inc(self, value: float = 1):
+        pass
+
+
+def _histogram(name: str, documentation: str, labels: Tuple[str, ...], buckets: Tuple[float, ...]):
+    return Histogram(name, documentation, labels, buckets=buckets) if Histogram else _NoopMetric()
+
+
+def _counter(name: str, documentation: str, labels: Tuple[str, ...]):
+    return Counter(name, documentation, labels) if Counter else _NoopMetric()
+
+
+QUEUE_WAIT = _histogram(
+    "kengine_queue_wait_seconds", "Time spent waiting before work starts", ("stage",), LATENCY_BUCKETS
+)
+TOKENIZE_TIME = _histogram("kengine_tokenize_seconds", "Tokenizer time per call", ("model",), LATENCY_BUCKETS)
+FORWARD_TIME = _histogram("kengine_forward_seconds", "Forward pass time per batch", ("model",), LATENCY_BUCKETS)
+SERIALIZE_TIME = _histogram(
+    "kengine_serialize_seconds", "Time to render embeddings into a response", ("format",), LATENCY_BUCKETS
+)
+BATCH_SIZE = _histogram("kengine_batch_size", "Rows per forward batch", ("model",), BATCH_SIZE_BUCKETS)
+PADDING_RATIO = _histogram(
+    "kengine_padding_ratio", "Share of padding tokens in a forward batch", ("model",), RATIO_BUCKETS
+)
+REQUESTS = _counter("kengine_requests_total", "Requests served", ("endpoint", "model"))
+TOKENS = _counter("kengine_tokens_total", "Tokens consumed by requests", ("endpoint", "model"))
+LANE_LATENCY = _histogram(
+    "kengine_lane_latency_seconds", "Embeddings request latency per priority lane", ("lane",), LATENCY_BUCKETS
+)
+SLO_VIOLATIONS = _counter("kengine_slo_violations_total", "Requests slower than their lane's latency target", ("lane",))
+POOL_EVENTS = _counter("kengine_pool_events_total", "Model pool loads and evictions", ("event",))
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Observe the wall time of the block into `histogram`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Body and content type for the `/metrics` endpoint.
+
+    With `PROMETHEUS_MULTIPROC_DIR` set (multi-process workers), the samples of all workers are merged.
+    """
+    if Counter is None:
+        return b"# prometheus_client is not installed\n", CONTENT_TYPE_LATEST
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,10 +1,37 @@
+import argparse
+import atexit
+import os
+import shutil
+import tempfile
+from functools import partial
+
 import aiohttp
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from src.serve.apis import MakeFastAPIOffline, mount_app_routes
-from src.serve.utils import parse_args
+from configs import config
+
+
+def prepare_multiprocess_metrics():
+    """Give prometheus_client a fresh directory shared by all workers when `--workers` > 1, so `/metrics`
+    merges every worker's samples. Has to run before prometheus_client is imported."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--workers", default=config.server.workers, type=int)
+    if parser.parse_known_args()[0].workers > 1 and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        directory = tempfile.mkdtemp(prefix="kengine-metrics-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = directory
+        # forked workers leave through os._exit, only this process removes it
+        atexit.register(shutil.rmtree, directory, ignore_errors=True)
+
+
+prepare_multiprocess_metrics()
+
+from src.serve.apis import MakeFastAPIOffline, mount_app_routes  # noqa: E402
+from src.serve.router import start_heartbeat  # noqa: E402
+from src.serve.utils import parse_args  # noqa: E402
+from src.serve.warmup import start_preloading  # noqa: E402
+from src.serve.workers import serve_workers  # noqa: E402
 
 fetch_timeout = aiohttp.ClientTimeout(total=3 * 3600)
 
@@ -37,11 +64,17 @@ def create_app(args):
     )
 
     mount_app_routes(app)
+    app.add_event_handler("startup", start_preloading)
+    if config.router.address:
+        app.add_event_handler("startup", partial(start_heartbeat, args.port))
 
     return app
 
 
 if __name__ == "__main__":
     args = parse_args()
-    app = create_app(args)
-    uvicorn.run(app, host=args.host, port=args.port)
+    if args.workers > 1:
+        serve_workers(partial(create_app, args), host=args.host, port=args.port, num_workers=args.workers)
+    else:
+        app = create_app(args)
+        uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,101 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(Path(__file__).parents[1].as_posix())
+from src.serve import admission as admission_module
+from src.serve.admission import AdmissionController, RateLimitedError, RequestTooLargeError, TokenBucket, estimate_tokens
+
+ADMISSION = {
+    "enable": True,
+    "max_input_items": 4,
+    "max_request_tokens": 1000,
+    "requests_per_second": 1,
+    "request_burst": 2,
+    "tokens_per_second": 100,
+    "token_burst": 200,
+    "keys": {"sk-bulk": {"max_input_items": 100}},
+}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def controller(monkeypatch, clock):
+    monkeypatch.setitem(admission_module.MODEL_CONFIG, "admission", ADMISSION)
+    return AdmissionController()
+
+
+def test_token_bucket_refills_up_to_burst(clock):
+    bucket = TokenBucket(rate=10, burst=20)
+    assert bucket.wait_time(20) == 0
+    bucket.take(20)
+    assert bucket.wait_time(5) == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert bucket.wait_time(5) == 0
+    clock[0] += 100
+    bucket.wait_time(0)
+    assert bucket.level == 20
+
+
+def test_token_bucket_oversized_amount_waits_for_full_bucket(clock):
+    bucket = TokenBucket(rate=10, burst=20)
+    assert bucket.wait_time(50) == 0
+    bucket.take(50)
+    assert bucket.wait_time(1) == pytest.approx(3.1)
+    bucket.give_back(100)
+    assert bucket.level == 20
+
+
+def test_estimate_tokens_caps_at_max_length():
+    assert estimate_tokens(["abc", "x" * 100, [1, 2]], max_length=10) == 5 + 10 + 4
+
+
+def test_admit_rejects_oversized_requests(controller):
+    with pytest.raises(RequestTooLargeError):
+        controller.admit("sk-a", items=5, tokens=10)
+    with pytest.raises(RequestTooLargeError):
+        controller.admit("sk-a", items=1, tokens=1001)
+    # per key override
+    controller.admit("sk-bulk", items=5, tokens=10)
+
+
+def test_admit_rate_limits_per_tenant(controller, clock):
+    controller.admit("sk-a", items=1, tokens=10)
+    controller.admit("sk-a", items=1, tokens=10)
+    with pytest.raises(RateLimitedError) as error:
+        controller.admit("sk-a", items=1, tokens=10)
+    assert error.value.retry_after == pytest.approx(1)
+    # other tenants have their own buckets
+    controller.admit("sk-b", items=1, tokens=10)
+    clock[0] += 1
+    controller.admit("sk-a", items=1, tokens=10)
+
+
+def test_rejected_request_takes_nothing(controller):
+    controller.admit("sk-a", items=1, tokens=150)
+    with pytest.raises(RateLimitedError):
+        controller.admit("sk-a", items=1, tokens=100)
+    # the request bucket was left untouched by the rejected request
+    controller.admit("sk-a", items=1, tokens=50)
+
+
+def test_settle_returns_unused_tokens(controller):
+    controller.admit("sk-a", items=1, tokens=200)
+    controller.settle("sk-a", reserved=200, used=120)
+    controller.admit("sk-a", items=1, tokens=80)
+    with pytest.raises(RateLimitedError):
+        controller.admit("sk-a", items=0, tokens=1, requests=0)
+
+
+def test_disabled_controller_admits_everything(monkeypatch, clock):
+    monkeypatch.setitem(admission_module.MODEL_CONFIG, "admission", {**ADMISSION, "enable": False})
+    controller = AdmissionController()
+    for _ in range(10):
+        controller.admit("sk-a", items=100, tokens=10**6)
@@ -0,0 +1,43 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(Path(__file__).parents[1].as_posix())
+from src.models.utils import plan_batches, prefetch
+
+
+def test_plan_batches_sorts_longest_first():
+    assert plan_batches([3, 9, 1, 5], batch_size=2) == [[1, 3], [0, 2]]
+
+
+def test_plan_batches_keeps_order_without_sorting():
+    assert plan_batches([3, 9, 1, 5], batch_size=3, sort_by_length=False) == [[0, 1, 2], [3]]
+
+
+def test_plan_batches_limits_padded_tokens():
+    lengths = [100, 10, 10, 10, 10, 90]
+    batches = plan_batches(lengths, batch_size=64, max_tokens_per_batch=200)
+    assert batches == [[0, 5], [1, 2, 3, 4]]
+    for batch in batches:
+        assert max(lengths[i] for i in batch) * len(batch) <= 200
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+
+
+def test_plan_batches_oversized_sample_gets_own_batch():
+    assert plan_batches([500, 10], max_tokens_per_batch=100) == [[0], [1]]
+
+
+def test_prefetch_keeps_order_and_applies_transform():
+    assert list(prefetch(range(10), depth=3, transform=lambda x: x * x)) == [x * x for x in range(10)]
+
+
+def test_prefetch_reraises_producer_error():
+    def items():
+        yield 1
+        raise ValueError("bad input")
+
+    iterator = prefetch(items())
+    assert next(iterator) == 1
+    with pytest.raises(ValueError):
+        next(iterator)
@@ -0,0 +1,122 @@
+import multiprocessing
+import sys
+from pathlib import Path
+
+import numpy
+import pytest
+
+sys.path.append(Path(__file__).parents[1].as_posix())
+from src.serve.embedding_cache import DiskEmbeddingStore, EmbeddingCache, text_digest
+
+
+def vectors(n, dim=4, start=0):
+    return numpy.arange(start * dim, (start + n) * dim, dtype=numpy.float32).reshape(n, dim)
+
+
+def test_disk_store_survives_reopen_and_growth(tmp_path):
+    store = DiskEmbeddingStore(tmp_path, dim=4, initial_rows=2)
+    digests = [text_digest(f"text {i}") for i in range(5)]
+    store.put_many(digests[:3], vectors(3), [1, 2, 3])
+    store.put_many(digests[2:], vectors(3, start=2), [3, 4, 5])
+    assert len(store) == 5
+    store.close()
+
+    store = DiskEmbeddingStore(tmp_path, dim=4)
+    assert len(store) == 5
+    vector, token_num = store.get(digests[4])
+    assert vector.tolist() == vectors(1, start=4)[0].tolist()
+    assert token_num == 5
+    assert store.get(text_digest("missing")) is None
+    store.close()
+
+
+def test_disk_store_ignores_unwritten_rows(tmp_path):
+    store = DiskEmbeddingStore(tmp_path, dim=4)
+    store.put_many([text_digest("a"), text_digest("b")], vectors(2), [1, 2])
+    store.close()
+    # a crash after the vector was written but before its token count was
+    (tmp_path / "tokens.i32").write_bytes((tmp_path / "tokens.i32").read_bytes()[:4])
+
+    store = DiskEmbeddingStore(tmp_path, dim=4)
+    assert len(store) == 1
+    assert store.get(text_digest("b")) is None
+    store.put_many([text_digest("b")], vectors(1, start=7), [9])
+    assert store.get(text_digest("b"))[1] == 9
+    store.close()
+
+
+def test_disk_stores_sharing_a_directory_see_each_other(tmp_path):
+    first = DiskEmbeddingStore(tmp_path, dim=4)
+    second = DiskEmbeddingStore(tmp_path, dim=4)
+    first.put_many([text_digest("a"), text_digest("b")], vectors(2), [1, 2])
+    second.put_many([text_digest("b"), text_digest("c")], vectors(2, start=1), [2, 3])
+    first.refresh()
+    assert len(first) == len(second) == 3
+    assert first.get(text_digest("c"))[0].tolist() == vectors(1, start=2)[0].tolist()
+    assert second.get(text_digest("a"))[1] == 1
+    first.close()
+    second.close()
+
+
+def write_rows(directory, worker):
+    store = DiskEmbeddingStore(directory, dim=4, initial_rows=8)
+    for batch in range(20):
+        ids = [worker * 1000 + batch * 5 + i for i in range(5)]
+        store.put_many([text_digest(str(i)) for i in ids], numpy.array([[i] * 4 for i in ids], dtype=numpy.float32), ids)
+    store.close()
+
+
+def test_disk_store_concurrent_processes(tmp_path):
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=write_rows, args=(tmp_path, worker)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    store = DiskEmbeddingStore(tmp_path, dim=4)
+    assert len(store) == 400
+    for worker in range(4):
+        for i in range(worker * 1000, worker * 1000 + 100):
+            vector, token_num = store.get(text_digest(str(i)))
+            assert vector.tolist() == [i] * 4 and token_num == i
+    store.close()
+
+
+def test_disk_store_rejects_other_dim(tmp_path):
+    DiskEmbeddingStore(tmp_path, dim=4).close()
+    with pytest.raises(ValueError):
+        DiskEmbeddingStore(tmp_path, dim=8)
+
+
+def test_cache_memory_lru_and_disk_tier(tmp_path):
+    namespace = EmbeddingCache.namespace("m", "cls", True)
+    cache = EmbeddingCache(max_items=2, disk_dir=tmp_path.as_posix())
+    cache.put_many(namespace, ["a", "b", "c"], vectors(3), [1, 2, 3])
+    assert cache.stats()["memory_items"] == 2
+
+    # a new process finds every vector on disk
+    cache = EmbeddingCache(max_items=2, disk_dir=tmp_path.as_posix())
+    entries = cache.get_many(namespace, ["a", "c", "d"])
+    assert entries[0][0].tolist() == vectors(1)[0].tolist() and entries[0][1] == 1
+    assert entries[1][1] == 3
+    assert entries[2] is None
+    assert cache.stats()["disk_hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_namespace_changes_with_serving_options():
+    base = EmbeddingCache.namespace("m", "cls", True)
+    assert EmbeddingCache.namespace("m", "cls", True) == base
+    assert EmbeddingCache.namespace("m", "mean", True) != base
+    assert EmbeddingCache.namespace("m", "cls", True, quantize="int8") != base
+    assert EmbeddingCache.namespace("m", "cls", True, dimensions=128) != base
+
+
+def test_cache_closes_least_recently_used_stores(tmp_path, monkeypatch):
+    monkeypatch.setattr(EmbeddingCache, "MAX_OPEN_STORES", 2)
+    cache = EmbeddingCache(disk_dir=tmp_path.as_posix())
+    namespaces = [EmbeddingCache.namespace(f"m{i}", "cls", True) for i in range(3)]
+    for namespace in namespaces:
+        cache.put_many(namespace, ["a"], vectors(1), [1])
+    assert list(cache._disk) == namespaces[1:]
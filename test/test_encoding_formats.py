@@ -0,0 +1,107 @@
+import base64
+import sys
+from pathlib import Path
+
+import numpy
+import pytest
+
+sys.path.append(Path(__file__).parents[1].as_posix())
+from src.models.utils import cast_embeddings
+from src.serve.utils import binary_embeddings_response, embedding_items, encode_embeddings
+
+EMBEDDINGS = numpy.array([[0.5, -1.25, 3.0], [1e-3, 0.0, -2.5]], dtype=numpy.float32)
+
+
+def test_float_format_is_nested_lists():
+    assert encode_embeddings(EMBEDDINGS, "float") == EMBEDDINGS.tolist()
+
+
+def test_base64_rows_decode_to_little_endian_float32():
+    rows = encode_embeddings(EMBEDDINGS.astype(">f4"), "base64")
+    decoded = numpy.stack([numpy.frombuffer(base64.b64decode(row), dtype="<f4") for row in rows])
+    assert numpy.array_equal(decoded, EMBEDDINGS)
+
+
+def test_binary_response_is_one_little_endian_buffer():
+    response = binary_embeddings_response(EMBEDDINGS, token_num=7)
+
+    assert response.media_type == "application/octet-stream"
+    assert response.headers["x-embedding-shape"] == "2,3"
+    assert response.headers["x-embedding-dtype"] == "float32"
+    assert response.headers["x-prompt-tokens"] == "7"
+    assert "x-embedding-scales-offset" not in response.headers
+    assert numpy.array_equal(numpy.frombuffer(response.body, dtype="<f4").reshape(2, 3), EMBEDDINGS)
+
+
+def test_embedding_items_carry_index_offset():
+    items = embedding_items({"embedding": EMBEDDINGS}, "float", offset=10)
+    assert [item["index"] for item in items] == [10, 11]
+    assert items[1]["embedding"] == EMBEDDINGS[1].tolist()
+
+
+def test_base64_keeps_float16():
+    rows = encode_embeddings(EMBEDDINGS.astype(numpy.float16), "base64")
+    assert len(base64.b64decode(rows[0])) == 3 * 2
+
+
+def test_binary_response_is_one_buffer_with_scales_after_it():
+    int8 = numpy.array([[127, -64, 0], [1, -127, 5]], dtype=numpy.int8)
+    scales = numpy.array([0.01, 0.02], dtype=numpy.float32)
+    response = binary_embeddings_response(int8, token_num=7, scales=scales)
+
+    assert response.headers["x-embedding-shape"] == "2,3"
+    assert response.headers["x-embedding-dtype"] == "int8"
+    assert response.headers["x-prompt-tokens"] == "7"
+    offset = int(response.headers["x-embedding-scales-offset"])
+    assert numpy.array_equal(numpy.frombuffer(response.body[:offset], dtype=numpy.int8).reshape(2, 3), int8)
+    assert numpy.array_equal(numpy.frombuffer(response.body[offset:], dtype="<f4"), scales)
+
+
+def test_embedding_items_carry_int8_scales():
+    items = embedding_items({"embedding": EMBEDDINGS, "scales": numpy.array([0.5, 0.25])}, "float")
+    assert [item["scale"] for item in items] == [0.5, 0.25]
+
+
+def test_cast_embeddings_truncates_and_renormalizes():
+    vectors, scales = cast_embeddings(EMBEDDINGS, dimensions=2, normalize=True)
+    assert vectors.shape == (2, 2) and scales is None
+    assert numpy.allclose(numpy.linalg.norm(vectors, axis=1), 1)
+    assert numpy.allclose(vectors[0], EMBEDDINGS[0, :2] / numpy.linalg.norm(EMBEDDINGS[0, :2]))
+    # dimensions at or above the model's leave the vectors as they are
+    assert numpy.array_equal(cast_embeddings(EMBEDDINGS, dimensions=8)[0], EMBEDDINGS)
+
+
+def test_cast_embeddings_float16():
+    vectors, scales = cast_embeddings(EMBEDDINGS, "float16")
+    assert vectors.dtype == numpy.float16 and scales is None
+    assert numpy.allclose(vectors, EMBEDDINGS, rtol=1e-3)
+
+
+def test_cast_embeddings_int8_dequantizes_within_half_a_step():
+    vectors, scales = cast_embeddings(EMBEDDINGS, "int8")
+    assert vectors.dtype == numpy.int8 and scales.dtype == numpy.float32
+    assert numpy.abs(vectors).max(axis=1).tolist() == [127, 127]
+    assert numpy.all(numpy.abs(vectors * scales[:, None] - EMBEDDINGS) <= scales[:, None] / 2 + 1e-7)
+
+
+def test_cast_embeddings_int8_zero_row():
+    vectors, scales = cast_embeddings(numpy.zeros((1, 3)), "int8")
+    assert vectors.tolist() == [[0, 0, 0]] and numpy.isfinite(scales).all()
+
+
+def test_cast_embeddings_rejects_unknown_dtype():
+    with pytest.raises(ValueError):
+        cast_embeddings(EMBEDDINGS, "bfloat16")
+
+
+@pytest.mark.parametrize("output_dtype", ["float32", "float16", "int8"])
+def test_device_cast_matches_host_cast(output_dtype):
+    import torch
+
+    from src.models import EmbeddingModel
+
+    on_device, device_scales = EmbeddingModel._cast_output(torch.from_numpy(EMBEDDINGS), output_dtype)
+    on_host, host_scales = cast_embeddings(EMBEDDINGS, output_dtype)
+    assert numpy.array_equal(on_device.numpy(), on_host)
+    if output_dtype == "int8":
+        assert numpy.allclose(device_scales.numpy(), host_scales)
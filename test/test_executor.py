@@ -0,0 +1,69 @@
+import asyncio
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.append(Path(__file__).parents[1].as_posix())
+from src.serve.executor import EngineOverloadedError, InferenceExecutor, _PriorityGate
+
+
+def test_priority_gate_admits_lowest_priority_first():
+    async def main():
+        gate = _PriorityGate(slots=1)
+        order = []
+
+        async def job(name, priority):
+            await gate.acquire(priority)
+            order.append(name)
+            await asyncio.sleep(0)
+            gate.release()
+
+        await gate.acquire(0)
+        tasks = [asyncio.create_task(job(name, priority)) for name, priority in [("p1", 1), ("q1", 0), ("p2", 1), ("q2", 0)]]
+        await asyncio.sleep(0.01)
+        gate.release()
+        await asyncio.gather(*tasks)
+        return order, gate.running
+
+    order, running = asyncio.run(main())
+    assert order == ["q1", "q2", "p1", "p2"]
+    assert running == 0
+
+
+def test_priority_gate_skips_cancelled_waiters():
+    async def main():
+        gate = _PriorityGate(slots=1)
+        await gate.acquire(0)
+        cancelled = asyncio.create_task(gate.acquire(0))
+        waiting = asyncio.create_task(gate.acquire(1))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        await asyncio.sleep(0.01)
+        gate.release()
+        await asyncio.wait_for(waiting, 1)
+        assert gate.running == 1
+        gate.release()
+        return gate.running
+
+    assert asyncio.run(main()) == 0
+
+
+def test_executor_rejects_beyond_max_queue():
+    async def main():
+        executor = InferenceExecutor(max_queue=1, workers_per_device=1)
+        release = threading.Event()
+        running = asyncio.create_task(executor.run("cpu", release.wait))
+        queued = asyncio.create_task(executor.run("cpu", lambda: "queued"))
+        await asyncio.sleep(0.05)
+        with pytest.raises(EngineOverloadedError):
+            await executor.run("cpu", lambda: "rejected")
+        release.set()
+        results = await asyncio.gather(running, queued)
+        executor.shutdown()
+        return results, executor.stats()
+
+    results, stats = asyncio.run(main())
+    assert results == [True, "queued"]
+    assert stats == {"cpu": 0}
@@ -0,0 +1,54 @@
+import json
+import sys
+import threading
+from pathlib import Path
+
+sys.path.append(Path(__file__).parents[1].as_posix())
+from src.serve.model_worker import EmbeddingsPool, resolve_pooler, sentence_transformers_pooling
+
+
+def test_local_model_without_pooling_config_uses_cls(tmp_path):
+    assert sentence_transformers_pooling(tmp_path.as_posix()) is None
+    assert resolve_pooler(tmp_path.as_posix(), "auto") == "cls"
+
+
+def test_local_model_pooling_config(tmp_path):
+    (tmp_path / "1_Pooling").mkdir()
+    (tmp_path / "1_Pooling" / "config.json").write_text(json.dumps({"pooling_mode_mean_tokens": True}))
+    assert resolve_pooler(tmp_path.as_posix(), "auto") == "mean"
+    assert resolve_pooler(tmp_path.as_posix(), "cls") == "cls"
+
+
+def test_unresolvable_model_falls_back_to_cls():
+    # neither a local directory nor a valid hub repo id
+    assert resolve_pooler("/no/such/model/dir", "auto") == "cls"
+
+
+def test_pool_stats_while_loading_and_evicting():
+    pool = EmbeddingsPool(cache_num=2)
+    errors = []
+
+    def load(worker):
+        for i in range(200):
+            pool._load((f"model-{worker}-{i % 5}", "cpu"), object)
+
+    def read_stats():
+        try:
+            while any(thread.is_alive() for thread in loaders):
+                pool.stats()
+                pool.memory_usage()
+                pool.keys()
+        except RuntimeError as e:
+            errors.append(e)
+
+    loaders = [threading.Thread(target=load, args=(worker,)) for worker in range(4)]
+    reader = threading.Thread(target=read_stats)
+    for thread in loaders:
+        thread.start()
+    reader.start()
+    for thread in loaders + [reader]:
+        thread.join()
+
+    assert errors == []
+    assert len(pool.keys()) <= 2
+    assert pool.stats()["evictions"] == pool.stats()["loads"] - len(pool.keys())
@@ -0,0 +1,61 @@
+import os
+import sys
+from pathlib import Path
+
+import numpy
+import pytest
+
+sys.path.append(Path(__file__).parents[1].as_posix())
+pytest.importorskip("onnxruntime")
+
+from src.models import EmbeddingModel, ORTEmbeddingModel
+from src.models import onnx_embedding
+
+MODEL = os.environ.get("KENGINE_TEST_MODEL", "maidalun1020/bce-embedding-base_v1")
+SENTENCES = [
+    "This is a test sentence",
+    "Another test sentence, a little longer than the first one so that the batch needs padding",
+    "用于检索相关文章的中文句子",
+    "x",
+]
+
+
+def test_onnx_matches_pytorch(tmp_path):
+    expected = EmbeddingModel(MODEL, device="cpu").encode(SENTENCES, enable_tqdm=False)
+    actual = ORTEmbeddingModel(MODEL, cache_dir=tmp_path.as_posix()).encode(SENTENCES, enable_tqdm=False)
+
+    assert actual.shape == expected.shape
+    assert numpy.abs(actual - expected).max() < 1e-4
+    assert (actual * expected).sum(axis=1).min() > 0.9999
+
+
+@pytest.fixture
+def tiny_model(tmp_path):
+    """A randomly initialized one-layer BERT saved locally, so no download is needed."""
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    path = tmp_path / "tiny-bert"
+    path.mkdir()
+    words = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + sorted({w for s in SENTENCES for w in s.lower().split()})
+    (path / "vocab.txt").write_text("\n".join(words))
+    BertTokenizerFast(vocab_file=(path / "vocab.txt").as_posix()).save_pretrained(path)
+    config = BertConfig(
+        vocab_size=len(words), hidden_size=16, num_hidden_layers=1, num_attention_heads=2, intermediate_size=32
+    )
+    BertModel(config).save_pretrained(path)
+    return path.as_posix()
+
+
+def test_cached_export_skips_torch_weights(tiny_model, tmp_path, monkeypatch):
+    cache_dir = (tmp_path / "onnx").as_posix()
+    expected = EmbeddingModel(tiny_model, device="cpu").encode(SENTENCES, enable_tqdm=False)
+    exported = ORTEmbeddingModel(tiny_model, cache_dir=cache_dir).encode(SENTENCES, enable_tqdm=False)
+
+    def no_weights(*args, **kwargs):
+        raise AssertionError("the PyTorch weights were loaded although an export is cached")
+
+    monkeypatch.setattr(onnx_embedding.AutoModel, "from_pretrained", no_weights)
+    cached = ORTEmbeddingModel(tiny_model, cache_dir=cache_dir)
+    assert cached.model is None
+    assert numpy.abs(cached.encode(SENTENCES, enable_tqdm=False) - exported).max() < 1e-6
+    assert numpy.abs(exported - expected).max() < 1e-4
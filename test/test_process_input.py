@@ -0,0 +1,34 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(Path(__file__).parents[1].as_posix())
+from src.serve.openai_api_server import get_tiktoken_encoding, process_input
+
+
+def test_text_inputs_pass_through():
+    assert process_input("m", "hello") == ["hello"]
+    assert process_input("m", ["a", "b"]) == ["a", "b"]
+    assert process_input("m", []) == []
+
+
+def test_native_token_ids_are_kept_as_lists():
+    assert process_input("m", [1, 2, 3], native_token_ids=True, vocab_size=10) == [[1, 2, 3]]
+    assert process_input("m", [[1], [2, 3]], native_token_ids=True, vocab_size=10) == [[1], [2, 3]]
+
+
+@pytest.mark.parametrize("inp", [[[1, 2], "a"], ["a", 1], [1.5], [[1.5]], [True, 2], [{"text": "a"}], [[1], 2]])
+def test_malformed_inputs_raise_value_error(inp):
+    with pytest.raises(ValueError):
+        process_input("m", inp, native_token_ids=True, vocab_size=10)
+
+
+@pytest.mark.parametrize("inp", [[10], [[1, -1]]])
+def test_ids_outside_the_vocabulary_raise_value_error(inp):
+    with pytest.raises(ValueError):
+        process_input("m", inp, native_token_ids=True, vocab_size=10)
+
+
+def test_tiktoken_encoding_cache_is_bounded():
+    assert get_tiktoken_encoding.cache_info().maxsize is not None
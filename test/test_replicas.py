@@ -0,0 +1,39 @@
+import gc
+import sys
+import weakref
+from pathlib import Path
+
+import numpy
+import pytest
+
+sys.path.append(Path(__file__).parents[1].as_posix())
+from src.models.replicas import ReplicatedModel
+
+
+class StubModel:
+    def __init__(self, device):
+        self.device = device
+
+    def encode(self, sentences, batch_size=256, return_token_nums=False, **kwargs):
+        return numpy.array([[len(sentence)] for sentence in sentences], dtype=numpy.float32)
+
+
+def test_encode_spreads_chunks_and_keeps_order():
+    model = ReplicatedModel(StubModel, ["cuda:0", "cuda:1"])
+    sentences = ["x" * n for n in range(1, 8)]
+    assert model.encode(sentences, batch_size=2)[:, 0].tolist() == list(range(1, 8))
+    assert model.outstanding() == [0, 0]
+    model.close()
+
+
+def test_close_stops_threads_and_releases_replicas():
+    model = ReplicatedModel(StubModel, ["cuda:0", "cuda:1"])
+    replicas = [weakref.ref(replica) for replica in model.replicas]
+    threads = list(model._threads)
+    model.close()
+    gc.collect()
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert all(replica() is None for replica in replicas)
+    with pytest.raises(RuntimeError):
+        model.encode(["a"])
@@ -0,0 +1,55 @@
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.append(Path(__file__).parents[1].as_posix())
+from src.serve.router import create_router_app, request_model
+
+
+class OverloadedWorker(BaseHTTPRequestHandler):
+    """Answers every request like a worker rejecting it with 429."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps({"object": "error", "message": "rate limit of this API key exceeded"}).encode()
+        self.send_response(429)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Retry-After", "3")
+        self.send_header("X-Prompt-Tokens", "0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def worker_address():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OverloadedWorker)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_proxy_relays_worker_headers(worker_address):
+    with TestClient(create_router_app()) as client:
+        client.post("/router/heartbeat", json={"address": worker_address, "models": ["m"]})
+        response = client.post("/v1/embeddings", json={"model": "m", "input": ["a"]})
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "3"
+        assert response.headers["x-prompt-tokens"] == "0"
+        assert response.headers.get_list("content-type") == ["application/json"]
+        assert response.json()["object"] == "error"
+        assert client.get("/router/workers").json()[0]["outstanding"] == 0
+
+
+def test_request_model():
+    assert request_model(b'{"model": "m", "input": "a"}', "application/json") == "m"
+    assert request_model(b'["a"]', "application/json") is None
+    assert request_model(b'{"model": "m"}', "application/x-ndjson") is None
@@ -0,0 +1,181 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import numpy
+import pytest
+
+sys.path.append(Path(__file__).parents[1].as_posix())
+from src.serve.admission import RequestTooLargeError
+from src.serve.executor import EngineOverloadedError
+from src.serve.scheduler import BatchScheduler, FairQueue, PendingItem
+
+
+class StubRunner:
+    """Embeds every text as `[len(text)]` and records the payload of each batch."""
+
+    def __init__(self, gate: asyncio.Event = None):
+        self.batches = []
+        self.gate = gate
+
+    async def __call__(self, payload):
+        self.batches.append(payload)
+        if self.gate is not None:
+            await self.gate.wait()
+        return {
+            "error_code": 0,
+            "text": "",
+            "embedding": numpy.array([[len(text)] for text in payload["input"]], dtype=numpy.float32),
+            "token_nums": [len(text) for text in payload["input"]],
+        }
+
+
+def test_large_request_is_split_and_reassembled():
+    async def main():
+        runner = StubRunner()
+        scheduler = BatchScheduler(runner, max_batch_size=4, max_wait_ms=1)
+        texts = ["x" * n for n in range(1, 11)]
+        result = await scheduler.submit({"model": "m", "input": texts})
+        return runner, result
+
+    runner, result = asyncio.run(main())
+    assert [len(batch["input"]) for batch in runner.batches] == [4, 4, 2]
+    assert result["embedding"][:, 0].tolist() == list(range(1, 11))
+    assert result["token_nums"] == list(range(1, 11))
+
+
+def test_concurrent_requests_share_a_batch():
+    async def main():
+        runner = StubRunner()
+        scheduler = BatchScheduler(runner, max_batch_size=8, max_wait_ms=50)
+        results = await asyncio.gather(
+            scheduler.submit({"model": "m", "input": ["a", "bb"], "tenant": "t1"}),
+            scheduler.submit({"model": "m", "input": ["ccc"], "tenant": "t2"}),
+            scheduler.submit({"model": "m", "input": ["dddd", "eeeee"], "tenant": "t1"}),
+        )
+        return runner, results
+
+    runner, results = asyncio.run(main())
+    assert len(runner.batches) == 1
+    assert sorted(runner.batches[0]["input"]) == ["a", "bb", "ccc", "dddd", "eeeee"]
+    assert [result["token_nums"] for result in results] == [[1, 2], [3], [4, 5]]
+    assert results[2]["embedding"][:, 0].tolist() == [4, 5]
+
+
+def test_requests_with_different_options_are_not_merged():
+    async def main():
+        runner = StubRunner()
+        scheduler = BatchScheduler(runner, max_batch_size=8, max_wait_ms=20)
+        await asyncio.gather(
+            scheduler.submit({"model": "m", "dimensions": 2, "input": ["a"]}),
+            scheduler.submit({"model": "m", "dimensions": 4, "input": ["b"]}),
+        )
+        return runner
+
+    runner = asyncio.run(main())
+    assert sorted(batch["dimensions"] for batch in runner.batches) == [2, 4]
+
+
+def test_cancelled_request_is_skipped():
+    async def main():
+        gate = asyncio.Event()
+        runner = StubRunner(gate)
+        scheduler = BatchScheduler(runner, max_batch_size=2, max_wait_ms=1, max_inflight=1)
+        first = asyncio.create_task(scheduler.submit({"model": "m", "input": ["a"]}))
+        await asyncio.sleep(0.05)
+        # taken as the next batch, waiting for the running one
+        second = asyncio.create_task(scheduler.submit({"model": "m", "input": ["b"]}))
+        await asyncio.sleep(0.05)
+        cancelled = asyncio.create_task(scheduler.submit({"model": "m", "input": ["c"]}))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        last = asyncio.create_task(scheduler.submit({"model": "m", "input": ["d"]}))
+        await asyncio.sleep(0.01)
+        gate.set()
+        await asyncio.gather(first, second, last)
+        return runner, scheduler
+
+    runner, scheduler = asyncio.run(main())
+    assert [batch["input"] for batch in runner.batches] == [["a"], ["b"], ["d"]]
+    assert scheduler.pending == 0
+
+
+def test_runner_error_reaches_every_request():
+    async def failing(payload):
+        raise RuntimeError("boom")
+
+    async def main():
+        scheduler = BatchScheduler(failing, max_batch_size=4, max_wait_ms=1)
+        return await asyncio.gather(
+            scheduler.submit({"model": "m", "input": ["a"]}),
+            scheduler.submit({"model": "m", "input": ["b"]}),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_error_result_is_returned_as_is():
+    async def rejecting(payload):
+        return {"error_code": 40001, "text": "too long"}
+
+    async def main():
+        scheduler = BatchScheduler(rejecting, max_batch_size=2, max_wait_ms=1)
+        return await scheduler.submit({"model": "m", "input": ["a", "b", "c"]})
+
+    assert asyncio.run(main()) == {"error_code": 40001, "text": "too long"}
+
+
+def test_max_pending_rejects_overflow():
+    async def main():
+        gate = asyncio.Event()
+        scheduler = BatchScheduler(StubRunner(gate), max_batch_size=4, max_wait_ms=1, max_pending=4)
+        waiting = asyncio.create_task(scheduler.submit({"model": "m", "input": ["a", "b", "c"]}))
+        await asyncio.sleep(0.01)
+        with pytest.raises(EngineOverloadedError):
+            await scheduler.submit({"model": "m", "input": ["d", "e"]})
+        gate.set()
+        await waiting
+
+    asyncio.run(main())
+
+
+def test_request_above_max_pending_is_too_large_even_when_idle():
+    async def main():
+        runner = StubRunner()
+        scheduler = BatchScheduler(runner, max_batch_size=4, max_wait_ms=1, max_pending=4)
+        with pytest.raises(RequestTooLargeError):
+            await scheduler.submit({"model": "m", "input": ["a"] * 5})
+        assert scheduler.pending == 0 and runner.batches == []
+        return await scheduler.submit({"model": "m", "input": ["a"] * 4})
+
+    assert asyncio.run(main())["token_nums"] == [1] * 4
+
+
+def test_idle_queue_is_dropped():
+    async def main():
+        scheduler = BatchScheduler(StubRunner(), max_batch_size=4, max_wait_ms=1)
+        scheduler.IDLE_TIMEOUT = 0.02
+        await scheduler.submit({"model": "m", "dimensions": 8, "input": ["a"]})
+        assert len(scheduler._queues) == 1
+        await asyncio.sleep(0.1)
+        assert scheduler._queues == {} and scheduler._workers == {}
+        # a later request starts a new loop
+        return await scheduler.submit({"model": "m", "dimensions": 8, "input": ["bb"]})
+
+    assert asyncio.run(main())["token_nums"] == [2]
+
+
+def test_fair_queue_takes_turns_between_tenants():
+    async def main():
+        loop = asyncio.get_running_loop()
+        queue = FairQueue()
+        for tenant, text in [("bulk", "b1"), ("bulk", "b2"), ("bulk", "b3"), ("user", "u1"), ("user", "u2")]:
+            queue.put_nowait(PendingItem(payload={"input": [text], "tenant": tenant}, future=loop.create_future()))
+        order = []
+        while not queue.empty():
+            order.append(queue.get_nowait().payload["input"][0])
+        return order
+
+    assert asyncio.run(main()) == ["b1", "u1", "b2", "u2", "b3"]
@@ -0,0 +1,59 @@
+import json
+import sys
+from pathlib import Path
+
+import numpy
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.append(Path(__file__).parents[1].as_posix())
+from configs import config
+from src.serve import utils
+
+
+async def stub_embed_texts(payload):
+    texts = payload["input"]
+    return {
+        "error_code": 0,
+        "text": "",
+        "embedding": numpy.array([[len(text), 0] for text in texts], dtype=numpy.float32),
+        "scales": None,
+        "token_nums": [len(text) for text in texts],
+    }
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(utils, "embed_texts", stub_embed_texts)
+    monkeypatch.setattr(config.embedding.stream, "batch_size", 2)
+    app = FastAPI()
+    app.post("/v1/embeddings/stream")(utils.stream_embeddings)
+    return TestClient(app)
+
+
+def post_ndjson(client, lines):
+    body = "\n".join(json.dumps(line) for line in lines)
+    return client.post("/v1/embeddings/stream", content=body, headers={"content-type": "application/x-ndjson"})
+
+
+def test_stream_returns_one_line_per_input_in_order(client):
+    response = post_ndjson(client, ["a", {"id": "doc-2", "text": "bb"}, "ccc", {"text": "dddd"}, "eeeee"])
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["index"] for line in lines[:-1]] == [0, 1, 2, 3, 4]
+    assert [line["embedding"][0] for line in lines[:-1]] == [1, 2, 3, 4, 5]
+    assert lines[1]["id"] == "doc-2"
+    assert lines[-1] == {"object": "usage", "count": 5, "prompt_tokens": 15, "total_tokens": 15}
+
+
+def test_stream_accepts_a_json_array(client):
+    response = client.post("/v1/embeddings/stream", json=["a", "bb"])
+    assert [json.loads(line).get("index") for line in response.text.splitlines()] == [0, 1, None]
+
+
+@pytest.mark.parametrize("bad_line", [42, [1, 2], {"id": "x"}, {"text": 7}, None])
+def test_stream_rejects_lines_that_are_not_texts(client, bad_line):
+    response = post_ndjson(client, ["a", bad_line, "c"])
+    assert response.status_code == 400
+    assert "input 1" in response.json()["message"]